@@ -20,8 +20,12 @@ Misha Schwartz, and Jaisie Sin
 === Module Description ===
 
 This file contains the different actions that can be made by a Player.
+
+The keys that make each action in the game window, ACTION_KEY and KEY_ACTION,
+are only created when they are first used, so that this module can be
+imported without pygame.
 """
-import pygame
+from typing import Any, Dict, Optional, Tuple
 
 # Actions that can be performed in the game
 ROTATE_CLOCKWISE = ('rotate', 1)
@@ -66,16 +70,33 @@ ACTION_PENALTY = {
     PASS: 0
 }
 
-ACTION_KEY = {
-    ROTATE_CLOCKWISE: pygame.K_d,
-    ROTATE_COUNTER_CLOCKWISE: pygame.K_a,
-    SWAP_HORIZONTAL: pygame.K_q,
-    SWAP_VERTICAL: pygame.K_e,
-    SMASH: pygame.K_SPACE,
-    COMBINE: pygame.K_c,
-    PAINT: pygame.K_r,
-    PASS: pygame.K_TAB
-}
 
-# Create a dictionary that is ACTION_KEY inverted
-KEY_ACTION = {value: key for key, value in ACTION_KEY.items()}
+def _action_keys() -> Dict[Tuple[str, Optional[int]], int]:
+    """Return the pygame key that makes each action in the game window.
+    """
+    import pygame
+
+    return {
+        ROTATE_CLOCKWISE: pygame.K_d,
+        ROTATE_COUNTER_CLOCKWISE: pygame.K_a,
+        SWAP_HORIZONTAL: pygame.K_q,
+        SWAP_VERTICAL: pygame.K_e,
+        SMASH: pygame.K_SPACE,
+        COMBINE: pygame.K_c,
+        PAINT: pygame.K_r,
+        PASS: pygame.K_TAB
+    }
+
+
+def __getattr__(name: str) -> Any:
+    """Return ACTION_KEY or KEY_ACTION, creating both the first time either
+    is used.
+    """
+    if name not in ['ACTION_KEY', 'KEY_ACTION']:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    action_key = _action_keys()
+    globals()['ACTION_KEY'] = action_key
+    # Create a dictionary that is ACTION_KEY inverted
+    globals()['KEY_ACTION'] = {value: key for key, value in action_key.items()}
+    return globals()[name]
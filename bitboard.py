@@ -0,0 +1,162 @@
+"""CSC148 Assignment 2
+
+=== CSC148 Winter 2020 ===
+Department of Computer Science,
+University of Toronto
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+Authors: Diane Horton, David Liu, Mario Badr, Sophia Huynh, Misha Schwartz,
+and Jaisie Sin
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) Diane Horton, David Liu, Mario Badr, Sophia Huynh,
+Misha Schwartz, and Jaisie Sin
+
+=== Module Description ===
+
+This file contains the BitBoard class, an encoding of a Blocky board as one
+bitset per colour that the goals can be evaluated on with a few whole-board
+bit operations.
+"""
+from __future__ import annotations
+from typing import Dict, Tuple
+
+from block import Block
+from settings import COLOUR_LIST
+
+
+def _popcount(bits: int) -> int:
+    """Return the number of bits set in <bits>.
+
+    >>> _popcount(0b1011)
+    3
+    """
+    return bin(bits).count('1')
+
+
+class BitBoard:
+    """A Blocky board encoded as one bitset per colour.
+
+    The unit cell at column i and row j of the board (see goal._flatten) is
+    bit i * dimension + j of the bitset of its colour, so each column of the
+    board is a run of <dimension> consecutive bits.
+
+    === Public Attributes ===
+    dimension:
+        The number of unit cells along each side of the board.
+    bits:
+        The bitset of the cells of each colour in COLOUR_LIST.
+
+    === Private Attributes ===
+    _full:
+        The bitset of every cell of the board.
+    _first_row:
+        The bitset of the cells in the top row of the board.
+    _last_row:
+        The bitset of the cells in the bottom row of the board.
+    _first_column:
+        The bitset of the cells in the leftmost column of the board.
+    _last_column:
+        The bitset of the cells in the rightmost column of the board.
+
+    === Representation Invariants ===
+    - the bitsets in <bits> do not overlap, and are subsets of <_full>.
+    """
+    dimension: int
+    bits: Dict[Tuple[int, int, int], int]
+    _full: int
+    _first_row: int
+    _last_row: int
+    _first_column: int
+    _last_column: int
+
+    def __init__(self, block: Block) -> None:
+        """Initialize this BitBoard from the leaves of <block>.
+        """
+        dimension = 2 ** (block.max_depth - block.level)
+        self.dimension = dimension
+        self.bits = {colour: 0 for colour in COLOUR_LIST}
+
+        self._full = (1 << (dimension * dimension)) - 1
+        self._first_column = (1 << dimension) - 1
+        self._last_column = self._first_column << (dimension * (dimension - 1))
+        self._first_row = self._full // self._first_column
+        self._last_row = self._first_row << (dimension - 1)
+
+        # Each entry is a block and the column and row of its upper-left cell.
+        pending = [(block, 0, 0)]
+        while pending:
+            current, x, y = pending.pop()
+            cells = 2 ** (current.max_depth - current.level)
+            children = current.children
+            if len(children) == 0:
+                # The first bit of each of <cells> columns, times a run of
+                # <cells> bits, is the square of cells at the origin.
+                columns = ((1 << (dimension * cells)) - 1) // \
+                    ((1 << dimension) - 1)
+                square = ((1 << cells) - 1) * columns
+                self.bits[current.colour] = \
+                    self.bits.get(current.colour, 0) | \
+                    (square << (x * dimension + y))
+            else:
+                half = cells // 2
+                pending.append((children[0], x + half, y))
+                pending.append((children[1], x, y))
+                pending.append((children[2], x, y + half))
+                pending.append((children[3], x + half, y + half))
+
+    def perimeter(self, colour: Tuple[int, int, int]) -> int:
+        """Return the number of unit cells of <colour> on the outer perimeter,
+        counting corner cells twice.
+        """
+        bits = self.bits.get(colour, 0)
+        return _popcount(bits & self._first_row) + \
+            _popcount(bits & self._last_row) + \
+            _popcount(bits & self._first_column) + \
+            _popcount(bits & self._last_column)
+
+    def largest_blob(self, colour: Tuple[int, int, int]) -> int:
+        """Return the number of unit cells in the largest blob of <colour>.
+
+        Each blob is grown from one of its cells by shifting the whole blob
+        one cell in every direction at once and masking it with the cells of
+        <colour>, until it stops growing.
+        """
+        remaining = self.bits.get(colour, 0)
+        dimension = self.dimension
+        # Shifting by one bit moves a cell to the next row, so cells that
+        # would wrap around into the next or previous column are masked off.
+        down_mask = self._full & ~self._first_row
+        up_mask = self._full & ~self._last_row
+        largest = 0
+
+        while remaining:
+            blob = remaining & -remaining
+            while True:
+                grown = blob | ((blob << 1) & down_mask) | \
+                    ((blob >> 1) & up_mask) | (blob << dimension) | \
+                    (blob >> dimension)
+                grown &= remaining
+                if grown == blob:
+                    break
+                blob = grown
+            largest = max(largest, _popcount(blob))
+            remaining &= ~blob
+
+        return largest
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'doctest', 'python_ta', 'typing', '__future__', 'block',
+            'settings'
+        ],
+        'max-attributes': 15
+    })
@@ -22,13 +22,89 @@ Misha Schwartz, and Jaisie Sin
 This file contains the Block class, the main data structure used in the game.
 """
 from __future__ import annotations
-from typing import Optional, Tuple, List
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple, List
 import random
 import math
 
 from settings import colour_name, COLOUR_LIST
 
 
+def _dihedral_group() -> Tuple[List[Tuple[int, int, int, int]],
+                               List[List[int]]]:
+    """Return the elements of the dihedral group of the square, acting on the
+    indices of a Block's four children, and their composition table.
+
+    Each element is a tuple <order>, which rearranges a list of children so
+    that the new child i is the old child order[i]. The identity is first,
+    followed by the generators in the order rotate clockwise, rotate
+    counter-clockwise, swap horizontally and swap vertically.
+    composition[a][b] is the element that performs a and then b.
+    """
+    elements = [(0, 1, 2, 3), (1, 2, 3, 0), (3, 0, 1, 2), (1, 0, 3, 2),
+                (3, 2, 1, 0)]
+    i = 0
+    while i < len(elements):
+        for generator in elements[1:5]:
+            product = tuple(elements[i][j] for j in generator)
+            if product not in elements:
+                elements.append(product)
+        i += 1
+
+    composition = [[elements.index(tuple(a[j] for j in b)) for b in elements]
+                   for a in elements]
+    return elements, composition
+
+
+# The elements of the dihedral group of the square, and how they compose.
+_ORIENTATIONS, _COMPOSE = _dihedral_group()
+_IDENTITY = 0
+_ROTATE_CLOCKWISE = 1
+_ROTATE_COUNTER_CLOCKWISE = 2
+_SWAP_HORIZONTAL = 3
+_SWAP_VERTICAL = 4
+
+# The <_memo> of every Block that has no cached values. It is never mutated,
+# so that a Block only allocates a dictionary once it caches a value.
+_NO_MEMO = {}
+
+_MASK = (1 << 64) - 1
+# The Zobrist keys of leaves, by (colour, level, max_depth).
+_LEAF_KEYS = {}
+
+
+def _mix(value: int) -> int:
+    """Return a 64-bit integer whose bits all depend on every bit of <value>.
+
+    This is the finalizer of the splitmix64 generator.
+    """
+    value = (value + 0x9E3779B97F4A7C15) & _MASK
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK
+    return value ^ (value >> 31)
+
+
+def leaf_hash(colour: Tuple[int, int, int], level: int,
+              max_depth: int) -> int:
+    """Return the 64-bit Zobrist key of a leaf of <colour> at <level>.
+    """
+    key = (colour, level, max_depth)
+    if key not in _LEAF_KEYS:
+        red, green, blue = colour
+        _LEAF_KEYS[key] = _mix((red << 40) | (green << 32) | (blue << 24) |
+                               (level << 12) | max_depth)
+    return _LEAF_KEYS[key]
+
+
+def parent_hash(level: int, hashes: List[int]) -> int:
+    """Return the 64-bit hash of a block at <level> whose children have the
+    given <hashes>, in order.
+    """
+    value = _mix((1 << 63) | level)
+    for child_hash in hashes:
+        value = _mix(value ^ child_hash)
+    return value
+
+
 def generate_board(max_depth: int, size: int) -> Block:
     """Return a new game board with a depth of <max_depth> and dimensions of
     <size> by <size>.
@@ -59,6 +135,11 @@ class Block:
     child's position. Indices 0, 1, 2, and 3 are the upper-right child,
     upper-left child, lower-left child, and lower-right child, respectively.
 
+    Positions are updated lazily: moving a Block only records that the
+    positions of its children are out of date, and they are recomputed the
+    next time its children are accessed. The positions of all blocks reached
+    by going down <children> from the root are therefore always up to date.
+
     === Public Attributes ===
     position:
         The (x, y) coordinates of the upper left corner of this Block.
@@ -79,6 +160,33 @@ class Block:
         stored in this order: upper-right child, upper-left child,
         lower-left child, lower-right child.
 
+    === Private Attributes ===
+    _position:
+        The stored value of <position>.
+    _colour:
+        The stored value of <colour>.
+    _children:
+        The stored value of <children>, before <_orientation> is applied.
+    _orientation:
+        The rotations and swaps of this Block that have not been applied to
+        <_children> yet, as the index of an element of the dihedral group of
+        the square in _ORIENTATIONS.
+    _stale:
+        True iff the order or positions of this Block's children may be out
+        of date and must be recomputed before they are used.
+    _hash:
+        The cached value of board_hash(), or None if it must be recomputed.
+    _memo:
+        The values cached by cached(), by key.
+    _parent:
+        The Block whose <_hash> or <_memo> was last computed from this
+        Block's, or None. It is used to discard the cached values of the
+        ancestors of a Block when the Block is mutated.
+    _shared:
+        True iff this Block may be part of more than one tree, because it was
+        shared by create_shared_copy. A shared Block, and all its descendants,
+        must not be mutated; use mutable_child to get a private copy first.
+
     === Representation Invariants===
     - len(children) == 0 or len(children) == 4
     - If this Block has children:
@@ -92,12 +200,24 @@ class Block:
         - its colour is not None.
     - level <= max_depth
     """
+    __slots__ = ('_position', 'size', '_colour', 'level', 'max_depth',
+                 '_children', '_orientation', '_stale', '_hash', '_memo',
+                 '_parent', '_shared')
     position: Tuple[int, int]
     size: int
     colour: Optional[Tuple[int, int, int]]
     level: int
     max_depth: int
     children: List[Block]
+    _position: Tuple[int, int]
+    _colour: Optional[Tuple[int, int, int]]
+    _children: List[Block]
+    _orientation: int
+    _stale: bool
+    _hash: Optional[int]
+    _memo: Dict[Hashable, Any]
+    _parent: Optional[Block]
+    _shared: bool
 
     def __init__(self, position: Tuple[int, int], size: int,
                  colour: Optional[Tuple[int, int, int]], level: int,
@@ -111,12 +231,76 @@ class Block:
             - level >= 0
             - max_depth >= level
         """
-        self.position = position
+        self._position = position
+        self._children = []
+        self._orientation = _IDENTITY
+        self._stale = False
+        self._hash = None
+        self._memo = _NO_MEMO
+        self._parent = None
+        self._shared = False
         self.size = size
         self.colour = colour
         self.level = level
         self.max_depth = max_depth
-        self.children = []
+
+    @property
+    def position(self) -> Tuple[int, int]:
+        """The (x, y) coordinates of the upper left corner of this Block.
+        """
+        return self._position
+
+    @position.setter
+    def position(self, position: Tuple[int, int]) -> None:
+        """Move this Block to <position>. Its descendants are moved lazily.
+        """
+        self._position = position
+        self._stale = True
+
+    @property
+    def colour(self) -> Optional[Tuple[int, int, int]]:
+        """The colour of this Block, or None if it has children.
+        """
+        return self._colour
+
+    @colour.setter
+    def colour(self, colour: Optional[Tuple[int, int, int]]) -> None:
+        """Change the colour of this Block to <colour>, discarding the cached
+        values that depend on it.
+        """
+        self._colour = colour
+        self._invalidate()
+
+    @property
+    def children(self) -> List[Block]:
+        """The blocks into which this block is subdivided, with their
+        positions brought up to date.
+        """
+        if self._stale:
+            if self._orientation != _IDENTITY:
+                order = _ORIENTATIONS[self._orientation]
+                self._children = [self._children[i] for i in order]
+                self._orientation = _IDENTITY
+            children = self._children
+            positions = self._children_positions()
+            for i in range(len(children)):
+                if children[i].position != positions[i]:
+                    if children[i]._shared:
+                        # The subtree has moved in this tree only.
+                        children[i] = children[i].create_shared_copy()
+                        children[i]._parent = self
+                    children[i].position = positions[i]
+            self._stale = False
+        return self._children
+
+    @children.setter
+    def children(self, children: List[Block]) -> None:
+        """Replace the children of this Block with <children>.
+        """
+        self._children = children
+        self._orientation = _IDENTITY
+        self._stale = True
+        self._invalidate()
 
     def __str__(self) -> str:
         """Return this Block in a string format.
@@ -143,7 +327,13 @@ class Block:
     def __eq__(self, other: Block) -> bool:
         """Return True iff this Block and all its descendents are equivalent to
         the <other> Block and all its descendents.
+
+        Two Blocks whose hashes differ are not equal, so a mismatch is usually
+        found without comparing their descendants.
         """
+        if isinstance(other, Block) and \
+                self.board_hash() != other.board_hash():
+            return False
         if len(self.children) == 0 and len(other.children) == 0:
             # Both self and other are leaves.
             return self.position == other.position and \
@@ -181,25 +371,14 @@ class Block:
         return [(x + size, y), (x, y), (x, y + size), (x + size, y + size)]
 
     def _update_children_positions(self, position: Tuple[int, int]) -> None:
-        """Set the position of this Block to <position> and update all its
-        descendants to have positions consistent with this Block's.
+        """Set the position of this Block to <position> and mark all its
+        descendants as needing positions consistent with this Block's.
 
         <position> is the (x, y) coordinates of the upper-left corner of this
-        Block.
+        Block. The descendants are repositioned lazily, as they are accessed,
+        so this takes constant time.
         """
-        if len(self.children) == 0:
-            self.position = position
-        else:
-            # block has children
-            self.position = position
-            children_positions = self._children_positions()
-            for i in range(4):
-                if len(self.children[i].children) == 0:
-                    self.children[i].position = children_positions[i]
-                else:
-                    self.children[i]._update_children_positions\
-                        (children_positions[i])
-            return
+        self.position = position
 
     def smashable(self) -> bool:
         """Return True iff this block can be smashed.
@@ -209,19 +388,25 @@ class Block:
         """
         return self.level != self.max_depth and len(self.children) == 0
 
-    def smash(self) -> bool:
+    def smash(self, journal: Optional[Journal] = None) -> bool:
         """Sub-divide this block so that it has four randomly generated
         children.
 
         If this Block's level is <max_depth>, do nothing. If this block has
         children, do nothing.
 
+        If the smash is performed and <journal> is not None, it is recorded in
+        <journal> so that it can be undone.
+
         Return True iff the smash was performed.
         """
         if not self.smashable():
             # this means that we can't smash this block
             return False
 
+        if journal is not None:
+            journal.record(self)
+
         size = self._child_size()
         positions = self._children_positions()
         level = self.level + 1
@@ -241,72 +426,81 @@ class Block:
 
         return True
 
-    def swap(self, direction: int) -> bool:
+    def swap(self, direction: int,
+             journal: Optional[Journal] = None) -> bool:
         """Swap the child Blocks of this Block.
 
         If this Block has no children, do nothing. Otherwise, if <direction> is
         1, swap vertically. If <direction> is 0, swap horizontally.
 
+        The swap is recorded in this Block's orientation and is only applied
+        to its list of children when they are next accessed.
+
+        If the swap is performed and <journal> is not None, it is recorded in
+        <journal> so that it can be undone.
+
         Return True iff the swap was performed.
 
         Precondition: <direction> is either 0 or 1
         """
-        if len(self.children) == 0:
+        if len(self._children) == 0:
             # no children
             return False
-        # swap horizontally
         if direction == 0:
-            self.children[0], self.children[1] = \
-                self.children[1], self.children[0]
-            self.children[2], self.children[3] = \
-                self.children[3], self.children[2]
-            # now updating children positions
-            self._update_children_positions(self.position)
+            self._reorient(_SWAP_HORIZONTAL, journal)
             return True
         elif direction == 1:
-            self.children[0], self.children[3] = \
-                self.children[3], self.children[0]
-            self.children[2], self.children[1] = \
-                self.children[1], self.children[2]
-            # now updating children positions
-            self._update_children_positions(self.position)
+            self._reorient(_SWAP_VERTICAL, journal)
             return True
         return False
 
-    def rotate(self, direction: int) -> bool:
+    def rotate(self, direction: int,
+               journal: Optional[Journal] = None) -> bool:
         """Rotate this Block and all its descendants.
 
         If this Block has no children, do nothing. If <direction> is 1, rotate
         clockwise. If <direction> is 3, rotate counter-clockwise.
 
+        The rotation is recorded in this Block's orientation and is only
+        applied to its list of children when they are next accessed.
+
+        If the rotate is performed and <journal> is not None, it is recorded in
+        <journal> so that it can be undone.
+
         Return True iff the rotate was performed.
 
         Precondition: <direction> is either 1 or 3.
         """
-        if len(self.children) == 0:
+        if len(self._children) == 0:
             # no children
             return False
-        # swap horizontally
         if direction == 1:
-            self.children[0], self.children[1], self.children[2],\
-            self.children[3] = self.children[1], self.children[2],\
-                               self.children[3], self.children[0]
-            # now updating children positions
-            self._update_children_positions(self.position)
+            self._reorient(_ROTATE_CLOCKWISE, journal)
             return True
         elif direction == 3:
-            self.children[0], self.children[1], self.children[2], \
-            self.children[3] = self.children[3], self.children[0], \
-                               self.children[1], self.children[2]
-            # now updating children positions
-            self._update_children_positions(self.position)
+            self._reorient(_ROTATE_COUNTER_CLOCKWISE, journal)
             return True
         return False
 
-    def paint(self, colour: Tuple[int, int, int]) -> bool:
+    def _reorient(self, transform: int, journal: Optional[Journal]) -> None:
+        """Compose <transform> onto the orientation of this Block, after any
+        rearrangement of its children that is still pending, and record it in
+        <journal> if it is not None.
+        """
+        if journal is not None:
+            journal.record(self)
+        self._orientation = _COMPOSE[self._orientation][transform]
+        self._stale = True
+        self._invalidate()
+
+    def paint(self, colour: Tuple[int, int, int],
+              journal: Optional[Journal] = None) -> bool:
         """Change this Block's colour iff it is a leaf at a level of max_depth
         and its colour is different from <colour>.
 
+        If the colour is changed and <journal> is not None, the change is
+        recorded in <journal> so that it can be undone.
+
         Return True iff this Block's colour was changed.
         """
         if not self.level == self.max_depth and len(self.children) != 0:
@@ -315,10 +509,12 @@ class Block:
         if self.colour == colour:
             # leaf has the same color; no need to paint it
             return False
+        if journal is not None:
+            journal.record(self)
         self.colour = colour
         return True
 
-    def combine(self) -> bool:
+    def combine(self, journal: Optional[Journal] = None) -> bool:
         """Turn this Block into a leaf based on the majority colour of its
         children.
 
@@ -329,6 +525,9 @@ class Block:
         If there is no majority colour, do nothing. If this block is not at a
         level of max_depth - 1, or this block has no children, do nothing.
 
+        If this Block is turned into a leaf and <journal> is not None, the
+        change is recorded in <journal> so that it can be undone.
+
         Return True iff this Block was turned into a leaf node.
         """
         if self.level != self.max_depth - 1 or len(self.children) == 0:
@@ -351,6 +550,8 @@ class Block:
                 count += 1
 
         if count == 1:
+            if journal is not None:
+                journal.record(self)
             self.children = []
             target = max(lst_of_colors, key=lst_of_colors.get)
             self.colour = target
@@ -358,28 +559,218 @@ class Block:
 
         return False
 
+    def board_hash(self) -> int:
+        """Return a 64-bit hash of the colours and structure of this Block and
+        all its descendants.
 
+        Equal blocks at the same position always have the same hash, and
+        different blocks have different hashes with overwhelming probability.
+        The hash is cached, and a move only discards the cached hashes of the
+        moved block and its ancestors, so it is cheap to call after each move.
+        """
+        if self._hash is None:
+            children = self.children
+            if len(children) == 0:
+                self._hash = leaf_hash(self.colour, self.level,
+                                       self.max_depth)
+            else:
+                for child in children:
+                    child._parent = self
+                self._hash = parent_hash(
+                    self.level, [child.board_hash() for child in children])
+        return self._hash
+
+    def cached(self, key: Hashable, compute: Callable[[Block], Any]) -> Any:
+        """Return compute(self), which is only computed the first time it is
+        requested for <key> after this Block or one of its descendants was
+        last mutated.
+
+        <compute> may use the cached values of this Block's children; they
+        are discarded along with this Block's when a child is mutated. The
+        returned value must not be mutated.
+        """
+        if key not in self._memo:
+            for child in self.children:
+                child._parent = self
+            value = compute(self)
+            if self._memo is _NO_MEMO:
+                self._memo = {}
+            self._memo[key] = value
+        return self._memo[key]
+
+    def _invalidate(self) -> None:
+        """Discard the cached hash and values of this Block and of all its
+        ancestors.
+        """
+        self._hash = None
+        self._memo = _NO_MEMO
+        block = self._parent
+        while block is not None and \
+                (block._hash is not None or len(block._memo) != 0):
+            block._hash = None
+            block._memo = _NO_MEMO
+            block = block._parent
+
+    def __getstate__(self) -> Tuple:
+        """Return the state of this Block to be pickled.
+
+        The cached hash and values are left out, since they are recomputed
+        when needed and are most of the size of a scored board.
+        """
+        return (self.position, self.size, self._colour, self.level,
+                self.max_depth, self.children)
+
+    def __setstate__(self, state: Tuple) -> None:
+        """Restore this Block from a <state> returned by __getstate__.
 
+        The restored Block is not shared with any other tree.
+        """
+        self._position, self.size, self._colour, self.level, \
+            self.max_depth, self._children = state
+        self._orientation = _IDENTITY
+        self._stale = False
+        self._hash = None
+        self._memo = _NO_MEMO
+        self._parent = None
+        self._shared = False
+
+    def _snapshot(self) -> Tuple:
+        """Return a snapshot of this Block for Journal.record: its colour, a
+        copy of its list of children, its orientation, and each Block whose
+        cached values a mutation of this Block discards, with its cached hash
+        and values.
+
+        The Blocks whose caches are discarded are those that _invalidate
+        visits.
+        """
+        caches = [(self, self._hash, self._memo)]
+        ancestor = self._parent
+        while ancestor is not None and \
+                (ancestor._hash is not None or len(ancestor._memo) != 0):
+            caches.append((ancestor, ancestor._hash, ancestor._memo))
+            ancestor = ancestor._parent
+        return self._colour, list(self._children), self._orientation, caches
+
+    def _restore(self, snapshot: Tuple) -> None:
+        """Restore this Block to a <snapshot> returned by _snapshot, for
+        Journal.undo.
+        """
+        colour, children, orientation, caches = snapshot
+        # Discard the values cached since the mutation before restoring the
+        # ones cached before it.
+        self._invalidate()
+        self._colour = colour
+        self._children = children
+        self._orientation = orientation
+        # The children may have been moved since, so reposition them.
+        self._stale = True
+        for cached_block, hash_, memo in caches:
+            cached_block._hash = hash_
+            cached_block._memo = memo
 
     def create_copy(self) -> Block:
         """Return a new Block that is a deep copy of this Block.
 
         Remember that a deep copy has new blocks (not aliases) at every level.
+
+        The cached hash and values are not copied; the copy recomputes them
+        when they are first requested.
         """
-        position = self.position
-        size = self.size
-        color = self.colour
-        level = self.level
-        max_depth = self.max_depth
-        new_block = Block(position, size, color, level, max_depth)
-        if len(self.children) == 0:
-            return new_block
-        else:
-            new_children = []
-            for child in self.children:
-                new_children.append(child.create_copy())
-            new_block.children = new_children
-            return new_block
+        new_block = Block(self.position, self.size, self._colour, self.level,
+                          self.max_depth)
+        children = self.children
+        if len(children) != 0:
+            # The children are up to date, so their copies are already in
+            # order and in position.
+            new_block._children = [child.create_copy() for child in children]
+        return new_block
+
+    def create_shared_copy(self) -> Block:
+        """Return a new Block that is a copy of this Block which shares all
+        its descendants with this Block.
+
+        No descendant is copied until it is about to be mutated (see
+        mutable_child), so only the path from this Block to a mutated block
+        is ever duplicated, in either tree.
+        """
+        new_block = Block(self.position, self.size, self.colour, self.level,
+                          self.max_depth)
+        new_block.children = list(self.children)
+        for child in self.children:
+            child._shared = True
+        new_block._hash = self._hash
+        new_block._memo = dict(self._memo)
+        return new_block
+
+    def mutable_child(self, index: int) -> Block:
+        """Return the child of this Block at <index>, after replacing it with
+        a private copy if it is shared with another tree.
+
+        The returned Block may be mutated without affecting any other tree.
+        Its own children may still be shared.
+
+        Precondition: this Block is not shared and 0 <= index < 4.
+        """
+        child = self.children[index]
+        if child._shared:
+            child = child.create_shared_copy()
+            child._parent = self
+            self.children[index] = child
+        return child
+
+
+class Journal:
+    """A record of mutations of Blocks, which can be undone exactly, most
+    recent first.
+
+    Each mutation is recorded just before it is made, as a snapshot of the
+    mutated Block and of the cached values that the mutation discards. Undoing
+    it restores the snapshot, so a search can make a move, score the board,
+    and undo the move without copying the board or rescoring it afterwards.
+
+    A CompactBlock can be recorded too; its snapshot is taken and restored by
+    the CompactBlock itself.
+
+    === Private Attributes ===
+    _records:
+        The mutated block and its snapshot, for each recorded mutation,
+        oldest first.
+    """
+    _records: List[Tuple[Block, Any]]
+
+    def __init__(self) -> None:
+        """Initialize this Journal with no mutations recorded.
+        """
+        self._records = []
+
+    def __len__(self) -> int:
+        """Return the number of mutations recorded in this Journal that have
+        not been undone.
+        """
+        return len(self._records)
+
+    def record(self, block: Block) -> None:
+        """Record the state of <block> before it is mutated.
+        """
+        self._records.append((block, block._snapshot()))
+
+    def undo(self) -> None:
+        """Undo the most recent mutation recorded in this Journal that has not
+        been undone.
+
+        Precondition: len(self) > 0
+        """
+        block, snapshot = self._records.pop()
+        block._restore(snapshot)
+
+    def rollback(self, size: int) -> None:
+        """Undo the most recent mutations recorded in this Journal until only
+        <size> remain.
+
+        Precondition: 0 <= size <= len(self)
+        """
+        while len(self._records) > size:
+            self.undo()
 
 
 if __name__ == '__main__':
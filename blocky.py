@@ -23,13 +23,15 @@ This file contains the different game states for the Blocky game.
 """
 
 from __future__ import annotations
-from typing import Dict, List, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Tuple
+import time
 import pygame
 
-from actions import ACTION_MESSAGE, ROTATE_CLOCKWISE, ROTATE_COUNTER_CLOCKWISE,\
-    SWAP_HORIZONTAL, SWAP_VERTICAL, SMASH, PASS, PAINT, COMBINE, ACTION_PENALTY
+from actions import ACTION_MESSAGE
 from block import Block
-from player import Player
+from engine import Engine, GameData
+from player import Player, move_on
 from renderer import Renderer
 from settings import ANIMATION_DURATION
 
@@ -60,69 +62,6 @@ def _block_to_squares(board: Block) -> List[Tuple[Tuple[int, int, int],
     return squares
 
 
-class GameData:
-    """
-    A bundle of the data needed for a Blocky game.
-
-    === Public Attributes ===
-    max_turns:
-        The maximum number of turns for the game.
-    board:
-        The Blocky board on which this game will be played.
-    players:
-        The entities that are playing this game.
-    smashes:
-        The number of smashes done by each player.
-    combines:
-        The number of combines done by each player.
-    paints:
-        The number of paints done by each player.
-
-    === Representation Invariants ===
-    - len(players) >= 1
-    """
-    max_turns: int
-    board: Block
-    players: List[Player]
-    smashes: Dict[int, int]
-    combines: Dict[int, int]
-    paints: Dict[int, int]
-
-    def __init__(self, board: Block, players: List[Player]) -> None:
-        """Initialize the game data, saving a reference to <board> and
-        <players>.
-
-        Precondition:
-            - len(players) >= 1
-        """
-        self.max_turns = 0
-        self.board = board
-        self.players = players
-
-        self.smashes = {}
-        self.combines = {}
-        self.paints = {}
-
-        # Start off all counts at 0
-        for player in players:
-            self.smashes[player.id] = 0
-            self.combines[player.id] = 0
-            self.paints[player.id] = 0
-
-    def calculate_score(self, player_id: int) -> Tuple[int, int]:
-        """Return a tuple containing first the <player_id>'s score based on
-        their goal in the game and second the deductions from their score based
-        on the actions they've taken.
-        """
-        goal_score = self.players[player_id].goal.score(self.board)
-
-        penalty = self.smashes[player_id] * ACTION_PENALTY[SMASH] + \
-                  self.combines[player_id] * ACTION_PENALTY[COMBINE] + \
-                  self.paints[player_id] * ACTION_PENALTY[PAINT]
-
-        return goal_score, penalty
-
-
 class GameState:
     """One of the different states that a Blocky game can be in.
     """
@@ -144,98 +83,108 @@ class GameState:
         """
         raise NotImplementedError
 
+    def close(self) -> None:
+        """Release the resources held by this GameState, when the game is
+        quit.
+        """
+        return
+
 
 class MainState(GameState):
     """A GameState that manages the moves made by different players in Blocky.
     """
     # === Private Attributes ===
-    # _turn:
-    #   The current turn.
-    # _data:
-    #   A reference to the shared GameData.
-    # _current_player_index:
-    #   The index of the current player in GameData.players.
+    # _engine:
+    #   The engine playing the game, with a reference to the shared GameData.
     # _current_score:
     #   The score of the current player, including penalties.
-    _turn: int
-    _data: GameData
-    _current_player_index: int
+    # _thinker:
+    #   The thread that the players who generate moves in the background
+    #   generate them in.
+    # _pending:
+    #   The move being generated in <_thinker> by the current player, on a
+    #   copy of the board, or None.
+    _engine: Engine
     _current_score: int
+    _thinker: ThreadPoolExecutor
+    _pending: Optional[Future]
 
     def __init__(self, data: GameData) -> None:
         """Initialize this GameState.
         """
-        self._turn = 0
-        self._data = data
-        self._current_player_index = 0
-
-        score, penalty = self._data.calculate_score(self._current_player().id)
-        self._current_score = score - penalty
+        self._engine = Engine(data)
+        self._thinker = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+        self._update_score()
 
     def _current_player(self) -> Player:
         """Return the player whose turn it is.
         """
-        return self._data.players[self._current_player_index]
+        return self._engine.current_player()
 
-    def _update_player(self) -> None:
-        """Update the player whose turn it is.
+    def _update_score(self) -> None:
+        """Update the score of the player whose turn it is.
         """
-        self._current_player_index = (self._current_player_index + 1) % len(
-            self._data.players)
-
-        score, penalty = self._data.calculate_score(self._current_player().id)
+        score, penalty = self._engine.data.calculate_score(
+            self._current_player().id)
         self._current_score = score - penalty
 
-        if self._current_player_index == 0:
-            self._turn += 1
-
     def _do_move(self, move: Tuple[str, Optional[int], Block]) -> bool:
         """Attempt to do the player's requested move.
         """
-        action = (move[0], move[1])
-        direction = move[1]
-        block = move[2]
-        player = self._current_player()
-        move_successful = False
-
-        if action in [ROTATE_CLOCKWISE, ROTATE_COUNTER_CLOCKWISE]:
-            move_successful = block.rotate(direction)
-        elif action in [SWAP_HORIZONTAL, SWAP_VERTICAL]:
-            move_successful = block.swap(direction)
-        elif action == SMASH:
-            move_successful = block.smash()
-            self._data.smashes[player.id] += int(move_successful)
-        elif action == PAINT:
-            move_successful = block.paint(self._current_player().goal.colour)
-            self._data.paints[player.id] += int(move_successful)
-        elif action == COMBINE:
-            move_successful = block.combine()
-            self._data.combines[player.id] += int(move_successful)
-        elif action == PASS:
-            # Do nothing
-            move_successful = True
-
+        move_successful = self._engine.make_move(move)
         if move_successful:
-            self._update_player()
+            self._update_score()
 
         return move_successful
 
+    def _generate_move(self) -> Optional[Tuple[str, Optional[int], Block]]:
+        """Return the move of the current player, or None if it has not made
+        one yet.
+
+        If the player generates moves in the background, its move is
+        generated in <_thinker> on a copy of the board, while the game keeps
+        rendering the board, and None is returned until it is ready. The copy
+        is a deep copy, since even reading a board caches values in its
+        blocks, and no block may be used by both threads. It is only taken
+        once the player is ready to move, so once per move.
+        """
+        player = self._current_player()
+        if not player.generates_in_background():
+            return player.generate_move(self._engine.data.board)
+
+        if self._pending is None:
+            if not player.ready_to_move():
+                return None
+            snapshot = self._engine.data.board.create_copy()
+            self._pending = self._thinker.submit(player.generate_move, snapshot)
+            return None
+        if not self._pending.done():
+            return None
+
+        move = self._pending.result()
+        self._pending = None
+        if move is None:
+            return None
+        return move_on(self._engine.data.board, move)
+
     def process_event(self, event: pygame.event.Event) -> None:
         self._current_player().process_event(event)
 
     def update(self) -> GameState:
-        if self._turn >= self._data.max_turns:
-            return GameOverState(self._data)
+        if self._engine.is_over():
+            self._thinker.shutdown(wait=False)
+            return GameOverState(self._engine.data)
 
         # Ask the player to make a move
-        move = self._current_player().generate_move(self._data.board)
+        move = self._generate_move()
 
         if move is None:
             # No move was made, stay in the current state
             return self
         else:
             # Save what the board looks like before the move
-            background = _block_to_squares(self._data.board)
+            background = _block_to_squares(self._engine.data.board)
             # Also save the current player ID
             player_id = self._current_player().id
 
@@ -248,17 +197,25 @@ class MainState(GameState):
                 return self
 
     def render(self, renderer: Renderer) -> None:
-        renderer.draw_board(_block_to_squares(self._data.board))
+        renderer.draw_board(_block_to_squares(self._engine.data.board))
 
-        b = self._current_player().get_selected_block(self._data.board)
+        b = self._current_player().get_selected_block(self._engine.data.board)
         if b is not None:
             renderer.highlight_block(b.position, b.size)
 
         p = self._current_player()
-        status = f'Turn {self._turn} | Player {p.id} | ' \
+        status = f'Turn {self._engine.turn} | Player {p.id} | ' \
                  f'Score {self._current_score} | {p.goal.description()}'
+        if self._pending is not None and not self._pending.done():
+            status += ' | Thinking...'
         renderer.draw_status(status)
 
+    def close(self) -> None:
+        """Stop generating moves in the background, without waiting for the
+        move being generated.
+        """
+        self._thinker.shutdown(wait=False, cancel_futures=True)
+
 
 class AnimateMoveState(GameState):
     """A GameState that animates a move made by a player before returning to its
@@ -278,7 +235,7 @@ class AnimateMoveState(GameState):
     _parent: GameState
     _player_id: int
     _move: Tuple[str, Optional[int], Block]
-    _start_time: int
+    _start_time: float
     _background: List[Tuple[Tuple[int, int, int], Tuple[int, int], int]]
 
     def __init__(self, parent: GameState, player_id: int,
@@ -291,13 +248,13 @@ class AnimateMoveState(GameState):
         self._player_id = player_id
         self._move = move
         self._background = background
-        self._start_time = pygame.time.get_ticks()
+        self._start_time = time.monotonic()
 
     def process_event(self, event: pygame.event.Event) -> None:
         return  # Ignore the event
 
     def update(self) -> GameState:
-        elapsed_seconds = (pygame.time.get_ticks() - self._start_time) / 1000
+        elapsed_seconds = time.monotonic() - self._start_time
 
         if elapsed_seconds > ANIMATION_DURATION:
             # The animation is complete, do the move, go back to the last
@@ -322,6 +279,9 @@ class AnimateMoveState(GameState):
         status = f'Player {self._player_id} is {ACTION_MESSAGE[action]}'
         renderer.draw_status(status)
 
+    def close(self) -> None:
+        self._parent.close()
+
 
 class GameOverState(GameState):
     """A GameState that is displayed when the game is over.
@@ -339,8 +299,8 @@ class GameOverState(GameState):
         """Initialize this GameState.
         """
         self._scores = []
-        for p in data.players:
-            goal_score, penalty = data.calculate_score(p.id)
+        for p, score in zip(data.players, data.calculate_scores()):
+            goal_score, penalty = score
             self._scores.append((p.id, goal_score, penalty))
 
         self._winner = max(self._scores, key=lambda item: item[1] - item[2])[0]
@@ -375,7 +335,8 @@ if __name__ == '__main__':
         'allowed-io': ['run_game'],
         'allowed-import-modules': [
             'doctest', 'python_ta', 'random', 'typing', 'pygame', '__future__',
-            'block', 'player', 'renderer', 'settings', 'actions'
+            'block', 'engine', 'player', 'renderer', 'settings', 'actions',
+            'concurrent.futures', 'time'
         ],
         'generated-members': 'pygame.*'
     })
@@ -0,0 +1,574 @@
+"""CSC148 Assignment 2
+
+=== CSC148 Winter 2020 ===
+Department of Computer Science,
+University of Toronto
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+Authors: Diane Horton, David Liu, Mario Badr, Sophia Huynh, Misha Schwartz,
+and Jaisie Sin
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) Diane Horton, David Liu, Mario Badr, Sophia Huynh,
+Misha Schwartz, and Jaisie Sin
+
+=== Module Description ===
+
+This file contains an array-backed representation of a Blocky board.
+
+A CompactBoard stores the whole quadtree in two flat typed arrays instead of
+one Block object per node. CompactBlock is a light-weight view onto one node
+of a CompactBoard that offers the same interface as Block, so the moves, the
+goals and the renderer can be used with either representation.
+"""
+from __future__ import annotations
+from array import array
+from typing import Optional, Tuple, List
+import random
+import math
+
+from block import Block, Journal, leaf_hash, parent_hash
+from settings import colour_name, COLOUR_LIST
+
+# The colour index stored for a node that has children.
+_INTERNAL = -1
+# The child offset stored for a node that has no children.
+_LEAF = -1
+
+
+def generate_compact_board(max_depth: int, size: int) -> CompactBlock:
+    """Return a new array-backed game board with a depth of <max_depth> and
+    dimensions of <size> by <size>.
+
+    The board is generated exactly like block.generate_board, so the same
+    random seed produces an equivalent board.
+
+    >>> board = generate_compact_board(3, 750)
+    >>> board.max_depth
+    3
+    >>> board.size
+    750
+    >>> len(board.children) == 4
+    True
+    """
+    board = CompactBoard((0, 0), size, random.choice(COLOUR_LIST), 0,
+                         max_depth)
+    root = board.root()
+    root.smash()
+
+    return root
+
+
+class CompactBoard:
+    """The storage for an array-backed Blocky board.
+
+    Node 0 is the root of the tree. The four children of an internal node are
+    stored next to each other, in the same order as Block.children, starting
+    at the index given by <offsets>.
+
+    === Public Attributes ===
+    position:
+        The (x, y) coordinates of the upper left corner of the root.
+    size:
+        The height and width of the root.
+    level:
+        The level of the root within the overall block structure.
+    max_depth:
+        The deepest level allowed in the overall block structure.
+    palette:
+        The colours used on this board. Nodes refer to their colour by its
+        index in <palette>.
+    colours:
+        For each node, the index of its colour in <palette>, or -1 if the node
+        has children.
+    offsets:
+        For each node, the index of its first child, or -1 if the node is a
+        leaf.
+    unreachable:
+        The number of nodes that are no longer reachable from the root.
+
+    === Representation Invariants ===
+    - len(colours) == len(offsets)
+    - colours[i] == -1 iff offsets[i] != -1
+    - nodes that are no longer reachable from the root (after a combine) are
+      left in place until the board is compacted.
+    - 0 <= unreachable < len(colours)
+    """
+    position: Tuple[int, int]
+    size: int
+    level: int
+    max_depth: int
+    palette: List[Tuple[int, int, int]]
+    colours: array
+    offsets: array
+    unreachable: int
+
+    def __init__(self, position: Tuple[int, int], size: int,
+                 colour: Tuple[int, int, int], level: int,
+                 max_depth: int) -> None:
+        """Initialize a board with a single leaf of <colour> at <level>.
+        """
+        self.position = position
+        self.size = size
+        self.level = level
+        self.max_depth = max_depth
+        self.palette = list(COLOUR_LIST)
+        self.colours = array('b', [self.colour_index(colour)])
+        self.offsets = array('i', [_LEAF])
+        self.unreachable = 0
+
+    def __len__(self) -> int:
+        """Return the number of nodes stored in this board, including nodes
+        that are no longer reachable from the root.
+        """
+        return len(self.colours)
+
+    def root(self) -> CompactBlock:
+        """Return a view of the root of this board.
+        """
+        return CompactBlock(self, 0, self.position, self.size, self.level)
+
+    def colour_index(self, colour: Tuple[int, int, int]) -> int:
+        """Return the index of <colour> in this board's palette, adding it to
+        the palette if needed.
+        """
+        try:
+            return self.palette.index(colour)
+        except ValueError:
+            self.palette.append(colour)
+            return len(self.palette) - 1
+
+    def add_children(self, index: int, colours: List[int]) -> int:
+        """Store four new leaves with the given colour indices as the children
+        of node <index>, and return the index of the first one.
+        """
+        first = len(self.colours)
+        self.colours.extend(colours)
+        self.offsets.extend([_LEAF] * 4)
+        self.colours[index] = _INTERNAL
+        self.offsets[index] = first
+        return first
+
+    def copy_subtree(self, index: int, position: Tuple[int, int], size: int,
+                     level: int) -> CompactBoard:
+        """Return a new board holding only the subtree rooted at node <index>,
+        whose root is at <position> with the given <size> and <level>.
+
+        Unreachable nodes are not copied, so this also compacts the storage.
+        """
+        new_board = CompactBoard.__new__(CompactBoard)
+        new_board.position = position
+        new_board.size = size
+        new_board.level = level
+        new_board.max_depth = self.max_depth
+        new_board.palette = list(self.palette)
+        new_board.colours = array('b', [self.colours[index]])
+        new_board.offsets = array('i', [_LEAF])
+        new_board.unreachable = 0
+
+        # The four children of a node are copied together, so that siblings
+        # stay next to each other in the new arrays.
+        pending = [(index, 0)]
+        while pending:
+            old, new = pending.pop()
+            first = self.offsets[old]
+            if first != _LEAF:
+                new_first = len(new_board.colours)
+                new_board.offsets[new] = new_first
+                new_board.colours.extend(self.colours[first:first + 4])
+                new_board.offsets.extend([_LEAF] * 4)
+                for i in range(4):
+                    pending.append((first + i, new_first + i))
+
+        return new_board
+
+    def copy(self) -> CompactBoard:
+        """Return a copy of this board.
+
+        The arrays are copied wholesale, unreachable nodes included, unless
+        at least half of the nodes are unreachable, in which case the copy is
+        compacted instead.
+        """
+        if 2 * self.unreachable >= len(self.colours):
+            return self.copy_subtree(0, self.position, self.size, self.level)
+
+        new_board = CompactBoard.__new__(CompactBoard)
+        new_board.position = self.position
+        new_board.size = self.size
+        new_board.level = self.level
+        new_board.max_depth = self.max_depth
+        new_board.palette = list(self.palette)
+        new_board.colours = array('b', self.colours)
+        new_board.offsets = array('i', self.offsets)
+        new_board.unreachable = self.unreachable
+        return new_board
+
+    @staticmethod
+    def from_block(block: Block) -> CompactBoard:
+        """Return a new board equivalent to <block> and all its descendants.
+        """
+        board = CompactBoard(block.position, block.size,
+                             COLOUR_LIST[0], block.level, block.max_depth)
+        pending = [(block, 0)]
+        while pending:
+            node, index = pending.pop()
+            if len(node.children) == 0:
+                board.colours[index] = board.colour_index(node.colour)
+            else:
+                first = board.add_children(index, [0, 0, 0, 0])
+                for i in range(4):
+                    pending.append((node.children[i], first + i))
+
+        return board
+
+
+class CompactBlock:
+    """A view of one node of a CompactBoard that behaves like a Block.
+
+    The view does not hold any state of its own besides where the node is:
+    its colour and children are read from, and written to, the arrays of the
+    board. The children of a view are new views that are created on demand.
+
+    === Public Attributes ===
+    position:
+        The (x, y) coordinates of the upper left corner of this block.
+    size:
+        The height and width of this square block.
+    level:
+        The level of this block within the overall block structure.
+
+    === Private Attributes ===
+    _board:
+        The board that stores this block.
+    _index:
+        The index of this block's node in the arrays of <_board>.
+    """
+    position: Tuple[int, int]
+    size: int
+    level: int
+    _board: CompactBoard
+    _index: int
+
+    def __init__(self, board: CompactBoard, index: int,
+                 position: Tuple[int, int], size: int, level: int) -> None:
+        """Initialize a view of node <index> of <board>.
+        """
+        self._board = board
+        self._index = index
+        self.position = position
+        self.size = size
+        self.level = level
+
+    @property
+    def max_depth(self) -> int:
+        """The deepest level allowed in the overall block structure.
+        """
+        return self._board.max_depth
+
+    @property
+    def colour(self) -> Optional[Tuple[int, int, int]]:
+        """The colour of this block, or None if it has children.
+        """
+        index = self._board.colours[self._index]
+        if index == _INTERNAL:
+            return None
+        return self._board.palette[index]
+
+    @property
+    def children(self) -> List[CompactBlock]:
+        """Views of the children of this block, in the same order as
+        Block.children.
+        """
+        first = self._board.offsets[self._index]
+        if first == _LEAF:
+            return []
+
+        size = self._child_size()
+        level = self.level + 1
+        return [CompactBlock(self._board, first + i, position, size, level)
+                for i, position in enumerate(self._children_positions())]
+
+    def __str__(self) -> str:
+        """Return this block in the same string format as Block.
+        """
+        indents = '\t' * self.level
+        if self._is_leaf():
+            colour = colour_name(self.colour)
+            return f'{indents}Leaf: colour={colour}, pos={self.position}, ' \
+                   f'size={self.size}, level={self.level}\n'
+
+        result = f'{indents}Parent: pos={self.position},' \
+                 f'size={self.size}, level={self.level}\n'
+        for child in self.children:
+            result += str(child)
+        return result
+
+    def __eq__(self, other: object) -> bool:
+        """Return True iff this block and all its descendants are equivalent to
+        the <other> block and all its descendants.
+
+        <other> may be either a Block or a CompactBlock.
+        """
+        self_children = self.children
+        other_children = other.children
+        if len(self_children) == 0 and len(other_children) == 0:
+            return self.position == other.position and \
+                self.size == other.size and \
+                self.colour == other.colour and \
+                self.level == other.level and \
+                self.max_depth == other.max_depth
+        elif len(self_children) != len(other_children):
+            return False
+
+        for i in range(4):
+            if self_children[i] != other_children[i]:
+                return False
+        return True
+
+    def board_hash(self) -> int:
+        """Return the same 64-bit hash as Block.board_hash for this block.
+
+        Compact boards do not cache hashes, so this visits every descendant.
+        """
+        if self._is_leaf():
+            return leaf_hash(self.colour, self.level, self.max_depth)
+        return parent_hash(self.level,
+                            [child.board_hash() for child in self.children])
+
+    def _is_leaf(self) -> bool:
+        """Return True iff this block has no children.
+        """
+        return self._board.offsets[self._index] == _LEAF
+
+    def _child_size(self) -> int:
+        """Return the size of this block's children.
+        """
+        return round(self.size / 2.0)
+
+    def _children_positions(self) -> List[Tuple[int, int]]:
+        """Return the positions of this block's four children, in the order
+        upper-right, upper-left, lower-left, lower-right.
+        """
+        x, y = self.position
+        size = self._child_size()
+        return [(x + size, y), (x, y), (x, y + size), (x + size, y + size)]
+
+    def _permute_children(self, order: Tuple[int, int, int, int]) -> None:
+        """Rearrange the children of this block so that the new child i is the
+        old child order[i].
+        """
+        board = self._board
+        first = board.offsets[self._index]
+        colours = board.colours[first:first + 4]
+        offsets = board.offsets[first:first + 4]
+        for i in range(4):
+            board.colours[first + i] = colours[order[i]]
+            board.offsets[first + i] = offsets[order[i]]
+
+    def smashable(self) -> bool:
+        """Return True iff this block can be smashed.
+        """
+        return self.level != self.max_depth and self._is_leaf()
+
+    def smash(self, journal: Optional[Journal] = None) -> bool:
+        """Sub-divide this block so that it has four randomly generated
+        children, exactly like Block.smash.
+
+        If the smash is performed and <journal> is not None, it is recorded in
+        <journal> so that it can be undone.
+
+        Return True iff the smash was performed.
+        """
+        if not self.smashable():
+            return False
+
+        if journal is not None:
+            journal.record(self)
+        board = self._board
+        colours = [board.colour_index(random.choice(COLOUR_LIST))
+                   for _ in range(4)]
+        board.add_children(self._index, colours)
+
+        for child in self.children:
+            if random.random() < math.exp(-0.25 * self.level):
+                child.smash()
+
+        return True
+
+    def swap(self, direction: int,
+             journal: Optional[Journal] = None) -> bool:
+        """Swap the child blocks of this block, exactly like Block.swap.
+
+        Children are swapped by exchanging their entries in the arrays, so
+        their descendants are moved along with them without being visited.
+
+        If the swap is performed and <journal> is not None, it is recorded in
+        <journal> so that it can be undone.
+
+        Return True iff the swap was performed.
+        """
+        if self._is_leaf() or direction not in (0, 1):
+            return False
+        if journal is not None:
+            journal.record(self)
+        if direction == 0:
+            self._permute_children((1, 0, 3, 2))
+        else:
+            self._permute_children((3, 2, 1, 0))
+        return True
+
+    def rotate(self, direction: int,
+               journal: Optional[Journal] = None) -> bool:
+        """Rotate this block, exactly like Block.rotate.
+
+        If the rotate is performed and <journal> is not None, it is recorded in
+        <journal> so that it can be undone.
+
+        Return True iff the rotate was performed.
+        """
+        if self._is_leaf() or direction not in (1, 3):
+            return False
+        if journal is not None:
+            journal.record(self)
+        if direction == 1:
+            self._permute_children((1, 2, 3, 0))
+        else:
+            self._permute_children((3, 0, 1, 2))
+        return True
+
+    def paint(self, colour: Tuple[int, int, int],
+              journal: Optional[Journal] = None) -> bool:
+        """Change this block's colour, exactly like Block.paint.
+
+        If the colour is changed and <journal> is not None, the change is
+        recorded in <journal> so that it can be undone.
+
+        Return True iff this block's colour was changed.
+        """
+        if not self.level == self.max_depth and not self._is_leaf():
+            return False
+        if self.colour == colour:
+            return False
+        if journal is not None:
+            journal.record(self)
+        self._board.colours[self._index] = self._board.colour_index(colour)
+        return True
+
+    def combine(self, journal: Optional[Journal] = None) -> bool:
+        """Turn this block into a leaf based on the majority colour of its
+        children, exactly like Block.combine.
+
+        The nodes of the old children are left in the arrays; they are
+        discarded when the board is next compacted.
+
+        If this block is turned into a leaf and <journal> is not None, the
+        change is recorded in <journal> so that it can be undone.
+
+        Return True iff this block was turned into a leaf node.
+        """
+        board = self._board
+        if self.level != self.max_depth - 1 or self._is_leaf():
+            return False
+
+        first = board.offsets[self._index]
+        counts = {}
+        for colour in board.colours[first:first + 4]:
+            counts[colour] = counts.get(colour, 0) + 1
+
+        most = max(counts.values())
+        if list(counts.values()).count(most) != 1:
+            return False
+
+        if journal is not None:
+            journal.record(self)
+        board.colours[self._index] = max(counts, key=counts.get)
+        board.offsets[self._index] = _LEAF
+        board.unreachable += 4
+        return True
+
+    def _snapshot(self) -> Tuple:
+        """Return a snapshot of this block for Journal.record: the number of
+        nodes and unreachable nodes in the board, the entries of this block's
+        node, and the entries of its children's nodes, or None if it is a
+        leaf.
+
+        A mutation only appends nodes to the arrays, so the nodes it adds are
+        removed by truncating the arrays to their recorded length.
+        """
+        board = self._board
+        first = board.offsets[self._index]
+        children = None
+        if first != _LEAF:
+            children = (board.colours[first:first + 4],
+                        board.offsets[first:first + 4])
+        return len(board.colours), board.unreachable, \
+            board.colours[self._index], first, children
+
+    def _restore(self, snapshot: Tuple) -> None:
+        """Restore this block to a <snapshot> returned by _snapshot, for
+        Journal.undo.
+        """
+        length, unreachable, colour, first, children = snapshot
+        board = self._board
+        del board.colours[length:]
+        del board.offsets[length:]
+        board.unreachable = unreachable
+        board.colours[self._index] = colour
+        board.offsets[self._index] = first
+        if children is not None:
+            board.colours[first:first + 4], board.offsets[first:first + 4] = \
+                children
+
+    def create_copy(self) -> CompactBlock:
+        """Return a new block that is a deep copy of this block, stored in a
+        board of its own.
+
+        A copy of the root copies the arrays of the board wholesale; a copy of
+        any other block only copies, and compacts, its subtree.
+        """
+        if self._index == 0:
+            return self._board.copy().root()
+        board = self._board.copy_subtree(self._index, self.position,
+                                         self.size, self.level)
+        return board.root()
+
+    def create_shared_copy(self) -> CompactBlock:
+        """Return a copy of this block, like Block.create_shared_copy.
+
+        Compact boards cannot share nodes between trees, so this is a deep
+        copy made by create_copy.
+        """
+        return self.create_copy()
+
+    def mutable_child(self, index: int) -> CompactBlock:
+        """Return the child of this block at <index>, like Block.mutable_child.
+
+        Compact boards never share nodes, so the child is always mutable.
+        """
+        return self.children[index]
+
+    def to_block(self) -> Block:
+        """Return a new Block that is equivalent to this block and all its
+        descendants.
+        """
+        block = Block(self.position, self.size, self.colour, self.level,
+                      self.max_depth)
+        block.children = [child.to_block() for child in self.children]
+        return block
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'doctest', 'python_ta', 'random', 'typing', '__future__', 'math',
+            'array', 'block', 'settings'
+        ],
+        'max-attributes': 15,
+        'max-args': 6
+    })
@@ -0,0 +1,281 @@
+"""CSC148 Assignment 2
+
+=== CSC148 Winter 2020 ===
+Department of Computer Science,
+University of Toronto
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+Authors: Diane Horton, David Liu, Mario Badr, Sophia Huynh, Misha Schwartz,
+and Jaisie Sin
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) Diane Horton, David Liu, Mario Badr, Sophia Huynh,
+Misha Schwartz, and Jaisie Sin
+
+=== Module Description ===
+
+This file contains the headless engine of the Blocky game: the game data,
+the rules for making moves and taking turns, and a game loop for computer
+players. It never imports pygame, so games can be played without a display;
+blocky.py and game.py build the pygame front end on top of it.
+"""
+from __future__ import annotations
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import random
+import time
+
+from actions import ROTATE_CLOCKWISE, ROTATE_COUNTER_CLOCKWISE, \
+    SWAP_HORIZONTAL, SWAP_VERTICAL, SMASH, PASS, PAINT, COMBINE, ACTION_PENALTY
+from block import Block, generate_board
+from goal import score_all
+from player import Player
+from settings import BOARD_SIZE
+
+
+class MoveStats(NamedTuple):
+    """The statistics of one move of a game.
+
+    <turn> is the turn the move was made in, <player_id> is the player who
+    made it, and <action> is its action and direction, as in actions.py.
+    <score> and <penalty> are the player's goal score and penalty after the
+    move, and <seconds> is how long the player took to generate it.
+    """
+    turn: int
+    player_id: int
+    action: Tuple[str, Optional[int]]
+    score: int
+    penalty: int
+    seconds: float
+
+
+class GameData:
+    """
+    A bundle of the data needed for a Blocky game.
+
+    === Public Attributes ===
+    max_turns:
+        The maximum number of turns for the game.
+    board:
+        The Blocky board on which this game will be played.
+    players:
+        The entities that are playing this game.
+    smashes:
+        The number of smashes done by each player.
+    combines:
+        The number of combines done by each player.
+    paints:
+        The number of paints done by each player.
+
+    === Representation Invariants ===
+    - len(players) >= 1
+    """
+    max_turns: int
+    board: Block
+    players: List[Player]
+    smashes: Dict[int, int]
+    combines: Dict[int, int]
+    paints: Dict[int, int]
+
+    def __init__(self, board: Block, players: List[Player]) -> None:
+        """Initialize the game data, saving a reference to <board> and
+        <players>.
+
+        Precondition:
+            - len(players) >= 1
+        """
+        self.max_turns = 0
+        self.board = board
+        self.players = players
+
+        self.smashes = {}
+        self.combines = {}
+        self.paints = {}
+
+        # Start off all counts at 0
+        for player in players:
+            self.smashes[player.id] = 0
+            self.combines[player.id] = 0
+            self.paints[player.id] = 0
+
+    def calculate_score(self, player_id: int) -> Tuple[int, int]:
+        """Return a tuple containing first the <player_id>'s score based on
+        their goal in the game and second the deductions from their score based
+        on the actions they've taken.
+        """
+        goal_score = self.players[player_id].goal.score(self.board)
+
+        return goal_score, self._penalty(player_id)
+
+    def _penalty(self, player_id: int) -> int:
+        """Return the deductions from <player_id>'s score based on the actions
+        they've taken.
+        """
+        return self.smashes[player_id] * ACTION_PENALTY[SMASH] + \
+            self.combines[player_id] * ACTION_PENALTY[COMBINE] + \
+            self.paints[player_id] * ACTION_PENALTY[PAINT]
+
+    def calculate_scores(self) -> List[Tuple[int, int]]:
+        """Return calculate_score(player.id) for every player, in order.
+
+        The goals of all the players are scored together, in a single pass
+        over the board.
+        """
+        goal_scores = score_all(self.board,
+                                [player.goal for player in self.players])
+
+        return [(goal_score, self._penalty(player.id))
+                for player, goal_score in zip(self.players, goal_scores)]
+
+    def do_move(self, player: Player,
+                move: Tuple[str, Optional[int], Block]) -> bool:
+        """Attempt to do <move> for <player>, counting it towards <player>'s
+        penalties if it is successful.
+
+        Return True iff the move was successful.
+        """
+        action = (move[0], move[1])
+        direction = move[1]
+        block = move[2]
+        move_successful = False
+
+        if action in [ROTATE_CLOCKWISE, ROTATE_COUNTER_CLOCKWISE]:
+            move_successful = block.rotate(direction)
+        elif action in [SWAP_HORIZONTAL, SWAP_VERTICAL]:
+            move_successful = block.swap(direction)
+        elif action == SMASH:
+            move_successful = block.smash()
+            self.smashes[player.id] += int(move_successful)
+        elif action == PAINT:
+            move_successful = block.paint(player.goal.colour)
+            self.paints[player.id] += int(move_successful)
+        elif action == COMBINE:
+            move_successful = block.combine()
+            self.combines[player.id] += int(move_successful)
+        elif action == PASS:
+            # Do nothing
+            move_successful = True
+
+        return move_successful
+
+
+class Engine:
+    """The rules of a game of Blocky, without a display: whose turn it is,
+    and making their moves.
+
+    === Public Attributes ===
+    data:
+        The data of the game being played.
+    turn:
+        The current turn.
+    current_player_index:
+        The index of the current player in data.players.
+
+    === Representation Invariants ===
+    - 0 <= current_player_index < len(data.players)
+    """
+    data: GameData
+    turn: int
+    current_player_index: int
+
+    def __init__(self, data: GameData) -> None:
+        """Initialize this Engine to play the game in <data> from its first
+        turn.
+        """
+        self.data = data
+        self.turn = 0
+        self.current_player_index = 0
+
+    def current_player(self) -> Player:
+        """Return the player whose turn it is.
+        """
+        return self.data.players[self.current_player_index]
+
+    def is_over(self) -> bool:
+        """Return True iff every turn of the game has been played.
+        """
+        return self.turn >= self.data.max_turns
+
+    def make_move(self, move: Tuple[str, Optional[int], Block]) -> bool:
+        """Attempt to do <move> for the current player, and if it is
+        successful, pass the turn to the next player.
+
+        Return True iff the move was successful.
+        """
+        if not self.data.do_move(self.current_player(), move):
+            return False
+
+        self.current_player_index = (self.current_player_index + 1) % len(
+            self.data.players)
+        if self.current_player_index == 0:
+            self.turn += 1
+        return True
+
+    def play(self, stats: Optional[List[MoveStats]] = None) \
+            -> List[Tuple[int, int]]:
+        """Play the rest of the game, and return the goal score and penalty
+        of each player, in order.
+
+        Each player is asked to proceed and then for its move. A move that is
+        not successful is replaced by PASS, so the game always ends. If
+        <stats> is not None, the MoveStats of each move are appended to it.
+
+        Precondition: every player is a computer player, whose moves are
+        generated without a display.
+        """
+        while not self.is_over():
+            turn = self.turn
+            player = self.current_player()
+            start = time.perf_counter()
+            player.proceed()
+            move = player.generate_move(self.data.board)
+            seconds = time.perf_counter() - start
+
+            if move is None or not self.make_move(move):
+                move = (PASS[0], PASS[1], self.data.board)
+                self.make_move(move)
+            if stats is not None:
+                score, penalty = self.data.calculate_score(player.id)
+                stats.append(MoveStats(turn, player.id, (move[0], move[1]),
+                                       score, penalty, seconds))
+
+        return self.data.calculate_scores()
+
+
+def simulate(max_depth: int, players: List[Player], num_turns: int,
+             seed: Optional[int] = None) \
+        -> Tuple[List[Tuple[int, int]], List[MoveStats]]:
+    """Play a game of <num_turns> turns between <players> on a random board
+    of <max_depth>, as fast as possible, and return the final goal score and
+    penalty of each player, in order, and the MoveStats of every move.
+
+    Unlike Game.run_game, nothing is displayed: there is no frame rate, no
+    animation and no events. random is seeded with <seed> first, so a game
+    between new players with the same arguments is played the same way,
+    unless a player uses another source of randomness.
+
+    Precondition: every player is a computer player, whose moves are
+    generated without a display, and player i has id i.
+    """
+    random.seed(seed)
+    data = GameData(generate_board(max_depth, BOARD_SIZE), players)
+    data.max_turns = num_turns
+
+    stats = []
+    scores = Engine(data).play(stats)
+    return scores, stats
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'doctest', 'python_ta', 'typing', '__future__', 'actions',
+            'block', 'goal', 'player', 'random', 'settings', 'time'
+        ]
+    })
@@ -23,15 +23,29 @@ This file contains some sample tests for Assignment 2.
 Please use this as a starting point to check your work and write your own
 tests!
 """
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import List, Optional, Tuple
 import os
+import pickle
+import random
+import subprocess
+import sys
+import time
 import pygame
 import pytest
 
-from block import Block
-from blocky import _block_to_squares
-from goal import BlobGoal, PerimeterGoal, _flatten
-from player import _get_block
+from bitboard import BitBoard
+from block import Block, Journal, generate_board
+from blocky import AnimateMoveState, GameData, MainState, \
+    _block_to_squares
+from compact_block import CompactBoard, generate_compact_board
+from engine import Engine, simulate
+import goal
+from goal import BlobGoal, PerimeterGoal, ScoreCache, SCORE_CACHE, _flatten, \
+    _flatten_indices, _largest_blob, _leaf_blob_size, _perimeter_cells, \
+    flatten_batch, score_all
+from player import LookaheadPlayer, MCTSPlayer, RandomPlayer, SmartPlayer, \
+    _get_block, get_blocks, legal_moves, move_on, random_legal_moves
 from renderer import Renderer
 from settings import COLOUR_LIST
 
@@ -257,6 +271,121 @@ class TestBlock:
         board_16x16.children[0].rotate(1)
         assert board_16x16 == board_16x16_rotate1
 
+    def test_rotate_updates_positions_lazily(self) -> None:
+        """Test that rotating only repositions descendants once they are
+        accessed, and that they are then consistent with their parents.
+        """
+        random.seed(148)
+        board = generate_board(4, 750)
+        board.rotate(1)
+        assert board._stale
+
+        pending = [board]
+        while pending:
+            block = pending.pop()
+            for i, child in enumerate(block.children):
+                assert child.position == block._children_positions()[i]
+                pending.append(child)
+
+    def test_board_hash_follows_moves(self, board_16x16,
+                                      board_16x16_swap0) -> None:
+        """Test that the cached hash is updated by every kind of move.
+        """
+        original = board_16x16.board_hash()
+        assert board_16x16_swap0.board_hash() != original
+
+        board_16x16.swap(0)
+        assert board_16x16.board_hash() == board_16x16_swap0.board_hash()
+        board_16x16.swap(0)
+        assert board_16x16.board_hash() == original
+
+        block = board_16x16.children[0].children[0]
+        assert block.paint(COLOUR_LIST[2])
+        painted = board_16x16.board_hash()
+        assert painted != original
+        assert board_16x16.create_copy().board_hash() == painted
+
+        board_16x16.children[0].rotate(1)
+        board_16x16.children[0].rotate(3)
+        assert board_16x16.board_hash() == painted
+
+        assert board_16x16.children[0].combine()
+        assert board_16x16.board_hash() != painted
+        assert board_16x16.children[1].smash()
+        assert board_16x16.board_hash() == \
+            board_16x16.create_copy().board_hash()
+        assert board_16x16.board_hash() == \
+            CompactBoard.from_block(board_16x16).root().board_hash()
+
+    def test_shared_copy_is_independent(self, board_16x16,
+                                        board_16x16_swap0) -> None:
+        """Test that mutating a shared copy, or the original, only copies the
+        mutated path and does not affect the other tree.
+        """
+        original = board_16x16.create_copy()
+        copy = board_16x16.create_shared_copy()
+        assert copy.children[2] is board_16x16.children[2]
+
+        copy.swap(0)
+        assert copy == board_16x16_swap0
+        assert board_16x16 == original
+
+        _get_block(copy, (10, 10), 2).paint(COLOUR_LIST[2])
+        assert board_16x16 == original
+
+        board_16x16.mutable_child(1).smash()
+        assert len(copy.children[0].children) == 0
+        assert copy.children[0].colour == COLOUR_LIST[2]
+
+    def test_journal_undo(self, board_16x16) -> None:
+        """Test that undoing the moves recorded in a journal restores the
+        board, its hash and its cached scores exactly.
+        """
+        original = board_16x16.create_copy()
+        goal_ = BlobGoal(COLOUR_LIST[1])
+        score = goal_.score(board_16x16)
+        journal = Journal()
+
+        assert board_16x16.rotate(1, journal)
+        assert board_16x16.children[3].swap(0, journal)
+        assert _get_block(board_16x16, (10, 10), 2).paint(COLOUR_LIST[0],
+                                                        journal)
+        goal_._score(board_16x16)
+        assert len(journal) == 3
+        journal.rollback(1)
+        assert board_16x16.children[3].combine(journal)
+        assert board_16x16.children[3].smash(journal)
+        assert not board_16x16.children[3].smash(journal)
+        assert len(journal) == 3
+
+        journal.rollback(0)
+        assert board_16x16 == original
+        assert board_16x16.board_hash() == original.board_hash()
+        assert board_16x16._memo != {}
+        assert goal_._score(board_16x16) == score
+        assert goal_._score(board_16x16) == \
+            _leaf_blob_size(board_16x16, COLOUR_LIST[1])
+
+    def test_copies_leave_out_caches(self) -> None:
+        """Test that copying or pickling a scored board does not copy its
+        cached values, and that the copies are scored correctly.
+        """
+        random.seed(148)
+        board = generate_board(5, 750)
+        cold = pickle.dumps(board)
+        goal_ = BlobGoal(COLOUR_LIST[1])
+        score = goal_._score(board)
+
+        assert len(pickle.dumps(board)) == len(cold)
+        for copy in [board.create_copy(), pickle.loads(cold)]:
+            assert copy._memo == {}
+            assert copy == board
+            assert goal_._score(copy) == score
+            assert copy.children[0].smash() or copy.children[0].rotate(1)
+            assert goal_._score(copy) == \
+                _leaf_blob_size(copy, COLOUR_LIST[1])
+        assert goal_._score(board) == score
+
 
 class TestPlayer:
     """A collection of methods for testing the methods and functions in the
@@ -273,6 +402,27 @@ class TestPlayer:
         assert _get_block(board_16x16, top_left, 0) == board_16x16
         assert _get_block(board_16x16, top_left, 1) == board_16x16.children[1]
 
+    def test_get_block_deepest_leaf(self) -> None:
+        """Test that a leaf above max_depth is returned for a deeper level."""
+        board = Block((0, 0), 750, COLOUR_LIST[0], 0, 3)
+        assert _get_block(board, (10, 10), 3) is board
+        assert _get_block(board, (750, 10), 3) is None
+
+    def test_get_blocks(self) -> None:
+        """Test that a batch of lookups finds the same blocks as looking each
+        location up on its own.
+        """
+        random.seed(148)
+        board = generate_board(5, 750)
+        for level in range(6):
+            locations = [(random.randrange(-10, 760),
+                          random.randrange(-10, 760)) for _ in range(100)]
+            expected = [_get_block(board, location, level)
+                        for location in locations]
+            found = get_blocks(board, locations, level)
+            assert all(block is expect
+                       for block, expect in zip(found, expected))
+
     def test_get_block_top_right(self, board_16x16) -> None:
         """Test that the correct block is retrieved from the reference board
         when requesting the top-right corner of the board.
@@ -283,6 +433,331 @@ class TestPlayer:
         assert _get_block(board_16x16, top_right, 2) == \
             board_16x16.children[0].children[0]
 
+    def test_legal_moves(self) -> None:
+        """Test that legal_moves yields exactly the moves that succeed when
+        they are tried on a copy of the board, without changing the board.
+        """
+        random.seed(148)
+        board = generate_board(3, 750)
+        original = board.create_copy()
+        colour = COLOUR_LIST[1]
+        found = {(move.action, move.direction, move.block.position,
+                  move.block.level) for move in legal_moves(board, colour)}
+        assert board == original
+
+        expected = set()
+        actions = [('rotate', 1), ('rotate', 3), ('swap', 0), ('swap', 1),
+                   ('smash', None), ('combine', None), ('paint', None)]
+        pending = [board]
+        while pending:
+            block = pending.pop()
+            pending.extend(block.children)
+            for action, direction in actions:
+                copy = board.create_copy()
+                target = _get_block(copy, block.position, block.level)
+                if goal.apply_move(target, action, direction, colour):
+                    expected.add((action, direction, block.position,
+                                  block.level))
+        assert found == expected
+
+    def test_legal_moves_on_shared_copy(self) -> None:
+        """Test that the moves yielded on a shared copy are made on the copy
+        only, and stay on the copy when their score delta is predicted.
+        """
+        random.seed(148)
+        board = generate_board(3, 750)
+        original = board.create_copy()
+        copy = board.create_shared_copy()
+        goal_ = BlobGoal(COLOUR_LIST[1])
+        moves = [move for move in legal_moves(copy, COLOUR_LIST[1])
+                 if move.action != 'smash']
+        for move in moves:
+            goal_.score_delta(copy, move)
+            assert _get_block(copy, move.block.position,
+                              move.block.level) is move.block
+
+        for move in moves:
+            goal.apply_move(move.block, move.action, move.direction,
+                            COLOUR_LIST[1])
+        assert board == original
+        assert copy != original
+
+    def test_no_legal_moves(self) -> None:
+        """Test that the players pass when no move can be made."""
+        board = Block((0, 0), 750, COLOUR_LIST[0], 0, 0)
+        assert random_legal_moves(board, COLOUR_LIST[0], 5) == []
+
+        for player in [RandomPlayer(0, BlobGoal(COLOUR_LIST[0])),
+                       SmartPlayer(1, BlobGoal(COLOUR_LIST[0]), 5)]:
+            player._proceed = True
+            assert player.generate_move(board) == ('pass', None, board)
+
+    def test_smart_player_executor(self) -> None:
+        """Test that a SmartPlayer assessing its moves in a process pool
+        chooses the same move for the same seed, whatever the number of
+        workers, and that the move is on the board and improves the score.
+        """
+        random.seed(148)
+        board = generate_board(4, 750)
+        goal_ = BlobGoal(COLOUR_LIST[2])
+        moves = []
+        for workers in [1, 3]:
+            with ProcessPoolExecutor(workers) as executor:
+                player = SmartPlayer(0, goal_, 40, executor, seed=7)
+                player._proceed = True
+                moves.append(player.generate_move(board))
+
+        action, direction, block = moves[0]
+        assert moves[1] == moves[0]
+        assert _get_block(board, block.position, block.level) is block
+        if action != 'smash':
+            assert goal_.score_delta(board, moves[0]) > 0
+
+        with ThreadPoolExecutor(2) as executor:
+            with pytest.raises(TypeError):
+                SmartPlayer(0, goal_, 40, executor, seed=7)
+
+    def test_mcts_player_finds_best_move(self) -> None:
+        """Test that with one turn left, an MCTSPlayer chooses the move with
+        the highest score minus penalty, without changing the board.
+        """
+        board = Block((0, 0), 750, None, 0, 1)
+        set_children(board, [COLOUR_LIST[0], COLOUR_LIST[1], COLOUR_LIST[2],
+                             COLOUR_LIST[1]])
+        original = board.create_copy()
+        goal_ = BlobGoal(COLOUR_LIST[1])
+        player = MCTSPlayer(0, goal_, 1, iterations=200, seed=148)
+        player._proceed = True
+
+        move = player.generate_move(board)
+        assert board == original
+        # Combining makes a blob of 4 for a penalty of 1; painting makes a
+        # blob of 3 for the same penalty.
+        assert move == ('combine', None, board)
+        assert player.generate_move(board) is None
+
+    def test_mcts_player_without_budget(self) -> None:
+        """Test that an MCTSPlayer whose budget is already spent still makes
+        a valid move, even after its last turn.
+        """
+        random.seed(148)
+        board = generate_board(3, 750)
+        for player in [MCTSPlayer(0, BlobGoal(COLOUR_LIST[0]), 1,
+                                  iterations=0, seed=148),
+                       MCTSPlayer(0, BlobGoal(COLOUR_LIST[0]), 1,
+                                  time_budget=0.0, seed=148)]:
+            for _ in range(3):
+                player._proceed = True
+                move = player.generate_move(board)
+                assert move is not None
+                assert move_on(board, move) == move
+            assert player._turns_left == 0
+
+    def test_mcts_player_reuses_subtree(self) -> None:
+        """Test that an MCTSPlayer reuses the subtree under its move when the
+        board is the one its move led to.
+        """
+        random.seed(148)
+        board = generate_board(3, 750)
+        player = MCTSPlayer(0, PerimeterGoal(COLOUR_LIST[0]), 3,
+                            iterations=100, seed=148)
+        player._proceed = True
+        move = player.generate_move(board)
+        kept = player._tree
+        if move.action != 'smash':
+            goal.apply_move(move.block, move.action, move.direction,
+                            COLOUR_LIST[0])
+            assert kept[0] == board.board_hash()
+            visits = kept[1].visits
+            player._proceed = True
+            player.generate_move(board)
+            assert kept[1].visits == visits + 100
+
+    def test_lookahead_player(self) -> None:
+        """Test that a LookaheadPlayer finds the best move one ply ahead, and
+        searches further without changing the board.
+        """
+        board = Block((0, 0), 750, None, 0, 1)
+        set_children(board, [COLOUR_LIST[0], COLOUR_LIST[1], COLOUR_LIST[2],
+                             COLOUR_LIST[1]])
+        player = LookaheadPlayer(0, BlobGoal(COLOUR_LIST[1]), [], 1, 20)
+        player._proceed = True
+        assert player.generate_move(board) == ('combine', None, board)
+
+        random.seed(148)
+        board = generate_board(3, 750)
+        original = board.create_copy()
+        player = LookaheadPlayer(0, BlobGoal(COLOUR_LIST[1]),
+                                 [PerimeterGoal(COLOUR_LIST[2])], 3, 2)
+        player._proceed = True
+        move = player.generate_move(board)
+        assert board == original
+        assert _get_block(board, move.block.position, move.block.level) \
+            is move.block
+        assert player.nodes_per_second > 0
+        assert len(player._table) <= 2 + 4
+
+    def test_lookahead_player_time_budget(self) -> None:
+        """Test that a LookaheadPlayer with a time budget returns a valid move
+        once its budget runs out, however deep it may search.
+        """
+        random.seed(148)
+        board = generate_board(4, 750)
+        goal_ = BlobGoal(COLOUR_LIST[0])
+        greedy = LookaheadPlayer(0, goal_, [], 1, 1)
+        greedy._proceed = True
+        expected = greedy.generate_move(board)
+
+        player = LookaheadPlayer(0, goal_, [PerimeterGoal(COLOUR_LIST[1])],
+                                 20, 10, time_budget=0.0)
+        player._proceed = True
+        start = time.monotonic()
+        move = player.generate_move(board)
+        assert time.monotonic() - start < 2
+        assert move == expected
+
+    def test_smart_player_compact_board(self) -> None:
+        """Test that a SmartPlayer chooses the same move on a compact board as
+        on the equivalent Block, and leaves the compact board unchanged.
+        """
+        random.seed(148)
+        board = generate_board(4, 750)
+        compact = CompactBoard.from_block(board).root()
+        goal_ = BlobGoal(COLOUR_LIST[2])
+        moves = []
+        for board_ in [board, compact]:
+            player = SmartPlayer(0, goal_, 40, seed=7)
+            player._proceed = True
+            random.seed(7)
+            action, direction, block = player.generate_move(board_)
+            moves.append((action, direction, block.position, block.level))
+
+        assert moves[1] == moves[0]
+        assert compact == board
+
+    def test_smart_player_time_budget(self) -> None:
+        """Test that a SmartPlayer with a time budget returns a valid move
+        once its budget runs out, however many moves it may assess.
+        """
+        random.seed(148)
+        board = generate_board(5, 750)
+        goal_ = BlobGoal(COLOUR_LIST[0])
+        goal_.score(board)
+        with ProcessPoolExecutor(1) as executor:
+            for pool in [None, executor]:
+                player = SmartPlayer(0, goal_, 10 ** 6, pool, 7, 0.05)
+                player._proceed = True
+                start = time.monotonic()
+                move = player.generate_move(board)
+                assert time.monotonic() - start < 2
+                assert _get_block(board, move.block.position,
+                                  move.block.level) is move.block
+
+    def test_main_state_waits_for_proceed(self, monkeypatch) -> None:
+        """Test that the game neither copies the board nor starts generating
+        a move in the background until the player is told to proceed.
+        """
+        random.seed(148)
+        board = generate_board(3, 750)
+        player = SmartPlayer(0, BlobGoal(COLOUR_LIST[0]), 5)
+        data = GameData(board, [player])
+        data.max_turns = 1
+        state = MainState(data)
+
+        copies = []
+        create_copy = Block.create_copy
+        monkeypatch.setattr(Block, 'create_copy',
+                            lambda block: copies.append(block) or
+                            create_copy(block))
+        for _ in range(10):
+            assert state.update() is state
+        assert copies == []
+        assert state._pending is None
+
+        player.proceed()
+        state.update()
+        assert [block for block in copies if block.level == 0] == [board]
+        state.close()
+
+    def test_main_state_generates_in_background(self) -> None:
+        """Test that the game keeps updating while a player generates its
+        move in the background, and then makes the move on the real board.
+        """
+        random.seed(148)
+        board = generate_board(3, 750)
+        player = SmartPlayer(0, BlobGoal(COLOUR_LIST[0]), 10 ** 6,
+                             time_budget=0.2)
+        data = GameData(board, [player])
+        data.max_turns = 1
+        state = MainState(data)
+        player._proceed = True
+
+        # The update does not wait for the move.
+        assert state.update() is state
+        assert state._pending is not None and not state._pending.done()
+
+        next_state = state
+        while next_state is state:
+            next_state = state.update()
+            time.sleep(0.01)
+        assert isinstance(next_state, AnimateMoveState)
+        block = next_state._move[2]
+        assert _get_block(board, block.position, block.level) is block
+
+        next_state.close()
+        with pytest.raises(RuntimeError):
+            state._thinker.submit(print)
+
+
+class TestEngine:
+    """A collection of methods for testing the headless engine."""
+    def test_engine_does_not_import_pygame(self) -> None:
+        """Test that the engine, and everything it imports, can be imported
+        without pygame.
+        """
+        code = 'import sys, engine; assert "pygame" not in sys.modules'
+        result = subprocess.run([sys.executable, '-c', code],
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                check=False)
+        assert result.returncode == 0
+
+    def test_play(self) -> None:
+        """Test that computer players play every turn of a headless game, and
+        that the scores are those of the final board.
+        """
+        random.seed(148)
+        board = generate_board(3, 750)
+        players = [RandomPlayer(0, BlobGoal(COLOUR_LIST[0])),
+                   SmartPlayer(1, PerimeterGoal(COLOUR_LIST[1]), 5)]
+        data = GameData(board, players)
+        data.max_turns = 4
+        engine = Engine(data)
+
+        scores = engine.play()
+        assert engine.is_over() and engine.turn == 4
+        assert scores == [data.calculate_score(0), data.calculate_score(1)]
+        assert scores[0][0] == _leaf_blob_size(board, COLOUR_LIST[0])
+
+    def test_simulate(self) -> None:
+        """Test that a simulated game records every move, ends with the final
+        scores, and is played the same way for the same seed.
+        """
+        results = []
+        for _ in range(2):
+            players = [RandomPlayer(0, BlobGoal(COLOUR_LIST[0])),
+                       SmartPlayer(1, PerimeterGoal(COLOUR_LIST[1]), 10)]
+            results.append(simulate(3, players, 5, 148))
+
+        scores, stats = results[0]
+        assert len(stats) == 10
+        assert [(move.turn, move.player_id) for move in stats[:3]] == \
+            [(0, 0), (0, 1), (1, 0)]
+        assert (stats[-1].score, stats[-1].penalty) == scores[1]
+        assert stats[-2].penalty == scores[0][1]
+        assert results[1][0] == scores
+        assert [move[:5] for move in results[1][1]] == \
+            [move[:5] for move in stats]
+
 
 class TestGoal:
     """A collection of methods for testing the sub-classes of Goal.
@@ -302,6 +777,192 @@ class TestGoal:
 
         assert result == flattened_board_16x16
 
+    def test_flatten_indices(self, board_16x16,
+                             flattened_board_16x16) -> None:
+        """Test that the colour-index grid matches the flattened board.
+        """
+        grid = _flatten_indices(board_16x16)
+
+        assert grid.dtype == 'uint8'
+        assert [[COLOUR_LIST[i] for i in column] for column in grid.tolist()] \
+            == flattened_board_16x16
+
+    def test_blob_scorers_agree(self, monkeypatch) -> None:
+        """Test that the blob scored on the leaves of the tree matches the blob
+        found on the flattened board, with and without numpy.
+        """
+        random.seed(148)
+        boards = [generate_board(depth, 750) for depth in range(0, 7)]
+        for board in boards:
+            for colour in COLOUR_LIST:
+                expected = BlobGoal(colour)._score(board)
+                grid = _flatten_indices(board)
+                assert BlobGoal(colour).score_grid(grid) == expected
+
+                with monkeypatch.context() as patch:
+                    patch.setattr(goal, 'np', None)
+                    mask = [[cell == colour for cell in column]
+                            for column in _flatten(board)]
+                    assert _largest_blob(mask) == expected
+
+    def test_perimeter_from_tree_matches_grid(self) -> None:
+        """Test that the perimeter counted on the tree matches the perimeter
+        counted on the flattened board.
+        """
+        random.seed(148)
+        for depth in range(0, 7):
+            board = generate_board(depth, 750)
+            grid = _flatten_indices(board)
+            for colour in COLOUR_LIST:
+                goal_ = PerimeterGoal(colour)
+                assert goal_._score(board) == goal_.score_grid(grid)
+
+    def test_largest_blob(self) -> None:
+        """Test the union-find blob search on masks with runs that only
+        connect through other columns.
+        """
+        mask = [[True, False, True, True],
+                [True, False, False, True],
+                [True, True, True, True],
+                [False, False, False, False]]
+        assert _largest_blob(mask) == 9
+        assert _largest_blob([[True, False], [False, True]]) == 1
+        assert _largest_blob([[False]]) == 0
+
+    def test_blob_goal_large_blob(self) -> None:
+        """Test that a blob far larger than the recursion limit is scored.
+        """
+        board = Block((0, 0), 750, COLOUR_LIST[0], 0, 8)
+        board.smash()
+        board.children[0].colour = COLOUR_LIST[1]
+        board.children[0].children = []
+        for child in board.children[1:]:
+            child.children = []
+            child.colour = COLOUR_LIST[0]
+
+        assert BlobGoal(COLOUR_LIST[0])._score(board) == 3 * 128 * 128
+
+    def test_incremental_scores_follow_moves(self) -> None:
+        """Test that the scores cached on the blocks are recomputed only for
+        the moved block and its ancestors, and stay correct.
+        """
+        random.seed(148)
+        board = generate_board(5, 750)
+        goals = [BlobGoal(colour) for colour in COLOUR_LIST] + \
+            [PerimeterGoal(colour) for colour in COLOUR_LIST]
+        for _ in range(100):
+            for goal_ in goals:
+                goal_._score(board)
+
+            location = (random.randrange(750), random.randrange(750))
+            block = _get_block(board, location, random.randint(1, 5))
+            if block is None or not block.rotate(1) and not block.smash():
+                continue
+            assert block._memo == {}
+            assert board._memo == {}
+            untouched = [child for child in board.children
+                         if child._memo != {}]
+            assert len(untouched) >= 3
+
+            for colour in COLOUR_LIST:
+                assert BlobGoal(colour)._score(board) == \
+                    _leaf_blob_size(board, colour)
+                assert PerimeterGoal(colour)._score(board) == \
+                    _perimeter_cells(board, colour)
+
+    def test_colour_assignment_discards_scores(self) -> None:
+        """Test that assigning the colour of a leaf directly discards the
+        scores and hashes cached on its ancestors.
+        """
+        random.seed(148)
+        board = generate_board(4, 750)
+        copy = board.create_copy()
+        for colour in COLOUR_LIST:
+            BlobGoal(colour)._score(board)
+            PerimeterGoal(colour)._score(board)
+
+        leaf = board
+        while len(leaf.children) != 0:
+            leaf = leaf.children[0]
+        leaf.colour = [c for c in COLOUR_LIST if c != leaf.colour][0]
+
+        assert board != copy
+        assert board.board_hash() != copy.board_hash()
+        for colour in COLOUR_LIST:
+            assert BlobGoal(colour)._score(board) == \
+                _leaf_blob_size(board, colour)
+            assert PerimeterGoal(colour)._score(board) == \
+                _perimeter_cells(board, colour)
+
+    def test_score_all(self, monkeypatch) -> None:
+        """Test that scoring every goal in one pass matches scoring each goal
+        separately, with and without numpy.
+        """
+        random.seed(148)
+        goals = [BlobGoal(colour) for colour in COLOUR_LIST] + \
+            [PerimeterGoal(colour) for colour in COLOUR_LIST]
+        for depth in range(0, 6):
+            board = generate_board(depth, 750)
+            expected = [goal_._score(board) for goal_ in goals]
+            assert score_all(board, goals) == expected
+
+            with monkeypatch.context() as patch:
+                patch.setattr(goal, 'np', None)
+                assert score_all(board, goals) == expected
+
+    def test_bitboard_scores(self, board_16x16) -> None:
+        """Test that the goals score a BitBoard like the board it encodes.
+        """
+        random.seed(148)
+        boards = [board_16x16] + [generate_board(depth, 750)
+                                  for depth in range(0, 7)]
+        for board in boards:
+            bits = BitBoard(board)
+            for colour in COLOUR_LIST:
+                for goal_ in [BlobGoal(colour), PerimeterGoal(colour)]:
+                    assert goal_.score_bitboard(bits) == goal_._score(board)
+
+    def test_score_batch(self) -> None:
+        """Test that scoring a stack of boards at once matches scoring them
+        one at a time.
+        """
+        random.seed(148)
+        boards = [generate_board(4, 750) for _ in range(20)]
+        grids = flatten_batch(boards)
+        assert grids.shape == (20, 16, 16)
+
+        for colour in COLOUR_LIST:
+            for goal_ in [BlobGoal(colour), PerimeterGoal(colour)]:
+                assert goal_.score_batch(grids).tolist() == \
+                    [goal_._score(board) for board in boards]
+
+    def test_score_delta(self, board_16x16) -> None:
+        """Test that the predicted change of score matches the change when the
+        move is made, and that the board is not changed.
+        """
+        original = board_16x16.create_copy()
+        compact = CompactBoard.from_block(board_16x16).root()
+        goal_ = BlobGoal(COLOUR_LIST[3])
+        before = goal_.score(board_16x16)
+        for board in [board_16x16, compact]:
+            moves = [('rotate', 1, board),
+                     ('swap', 0, board.children[0]),
+                     ('paint', None, board.children[0].children[1]),
+                     ('combine', None, board.children[0]),
+                     ('smash', None, board.children[1]),
+                     ('pass', None, board)]
+            for move in moves:
+                delta = goal_.score_delta(board, move)
+                assert board == original
+                if move[0] != 'smash':
+                    copy = board.create_copy()
+                    block = _get_block(copy, move[2].position, move[2].level)
+                    goal.apply_move(block, move[0], move[1], COLOUR_LIST[3])
+                    assert delta == goal_.score(copy) - before
+
+            assert goal_.score_delta(board, moves[5]) == 0
+            assert goal_.score(board) == before
+
     def test_blob_goal(self, board_16x16) -> None:
         correct_scores = [
             (COLOUR_LIST[0], 1),
@@ -328,6 +989,118 @@ class TestGoal:
             goal = PerimeterGoal(colour)
             assert goal.score(board_16x16) == expected
 
+    def test_score_cache(self, board_16x16) -> None:
+        """Test that scores are cached by board hash and recomputed after a
+        move.
+        """
+        SCORE_CACHE.clear()
+        goal = BlobGoal(COLOUR_LIST[3])
+        assert goal.score(board_16x16) == 5
+        assert goal.score(board_16x16.create_copy()) == 5
+        assert PerimeterGoal(COLOUR_LIST[3]).score(board_16x16) == 5
+        assert (SCORE_CACHE.hits, SCORE_CACHE.misses) == (1, 2)
+
+        board_16x16.children[0].children[0].paint(COLOUR_LIST[3])
+        assert goal.score(board_16x16) == 6
+        assert SCORE_CACHE.misses == 3
+
+    def test_score_cache_eviction(self) -> None:
+        """Test that the least recently used score is discarded first.
+        """
+        cache = ScoreCache(2)
+        cache.store('a', 1)
+        cache.store('b', 2)
+        assert cache.lookup('a') == 1
+        cache.store('c', 3)
+        assert len(cache) == 2
+        assert cache.lookup('b') is None
+        assert cache.lookup('a') == 1
+        assert (cache.hits, cache.misses) == (2, 1)
+
+
+class TestCompactBlock:
+    """A collection of methods that test the array-backed CompactBlock view
+    against the Block class.
+    """
+    def test_generate_same_as_block(self) -> None:
+        """Test that the same seed generates equivalent boards.
+        """
+        random.seed(148)
+        board = generate_board(4, 750)
+        random.seed(148)
+        compact = generate_compact_board(4, 750)
+
+        assert compact == board
+        assert compact.to_block() == board
+
+    def test_swap0(self, board_16x16, board_16x16_swap0) -> None:
+        """Test that the compact reference board is swapped like a Block.
+        """
+        compact = CompactBoard.from_block(board_16x16).root()
+        compact.swap(0)
+        assert compact == board_16x16_swap0
+
+    def test_rotate1(self, board_16x16, board_16x16_rotate1) -> None:
+        """Test that a child of the compact reference board is rotated like a
+        Block.
+        """
+        compact = CompactBoard.from_block(board_16x16).root()
+        compact.children[0].rotate(1)
+        assert compact == board_16x16_rotate1
+
+    def test_combine_and_copy(self, board_16x16) -> None:
+        """Test that combining leaves garbage behind that compacting discards,
+        and that a copy is independent of the original.
+        """
+        compact = CompactBoard.from_block(board_16x16).root()
+        assert compact.combine() is False
+        assert compact.children[0].combine()
+        assert board_16x16.children[0].combine()
+        assert compact == board_16x16
+        assert compact._board.unreachable == 4
+
+        compacted = compact._board.copy_subtree(0, compact.position,
+                                                compact.size, compact.level)
+        assert len(compacted) == len(compact._board) - 4
+        assert compacted.root() == compact
+
+        copy = compact.create_copy()
+        assert len(copy._board) == len(compact._board)
+        copy.children[1].smash()
+        assert copy != compact
+
+    def test_random_moves_match_block(self) -> None:
+        """Test that random sequences of rotations and swaps leave a Block and
+        a CompactBlock in the same state.
+        """
+        random.seed(148)
+        board = generate_board(4, 750)
+        compact = CompactBoard.from_block(board).root()
+
+        for _ in range(200):
+            location = (random.randrange(750), random.randrange(750))
+            level = random.randint(0, 3)
+            block = _get_block(board, location, level)
+            view = _get_block(compact, location, level)
+            if block is None:
+                assert view is None
+            elif random.random() < 0.5:
+                direction = random.choice([1, 3])
+                assert block.rotate(direction) == view.rotate(direction)
+            else:
+                direction = random.choice([0, 1])
+                assert block.swap(direction) == view.swap(direction)
+
+        assert compact == board
+
+    def test_goals(self, board_16x16) -> None:
+        """Test that the goals score a compact board like a Block.
+        """
+        compact = CompactBoard.from_block(board_16x16).root()
+        for colour in COLOUR_LIST:
+            for goal_ in [BlobGoal(colour), PerimeterGoal(colour)]:
+                assert goal_.score(compact) == goal_.score(board_16x16)
+
 
 if __name__ == '__main__':
     pytest.main(['example_tests.py'])
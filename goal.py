@@ -22,11 +22,21 @@ Misha Schwartz, and Jaisie Sin
 This file contains the hierarchy of Goal classes.
 """
 from __future__ import annotations
+from collections import OrderedDict
 import random
-from typing import List, Tuple
-from block import Block
+from typing import Any, Hashable, List, Optional, Tuple, Union
+from bitboard import BitBoard
+from block import Block, Journal
 from settings import colour_name, COLOUR_LIST
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# The index stored in a colour-index grid for a colour not in COLOUR_LIST.
+UNKNOWN_COLOUR = 255
+
 
 def generate_goals(num_goals: int) -> List[Goal]:
     """Return a randomly generated list of goals with length num_goals.
@@ -94,6 +104,591 @@ def _flatten(block: Block) -> List[List[Tuple[int, int, int]]]:
         return f2
 
 
+def _colour_index(colour: Tuple[int, int, int]) -> int:
+    """Return the index of <colour> in COLOUR_LIST, or UNKNOWN_COLOUR if it is
+    not in COLOUR_LIST.
+    """
+    if colour in COLOUR_LIST:
+        return COLOUR_LIST.index(colour)
+    return UNKNOWN_COLOUR
+
+
+def _flatten_indices(block: Block) -> np.ndarray:
+    """Return a two-dimensional uint8 array G representing <block> as columns
+    and rows of unit cells, like _flatten.
+
+    G[i, j] is the index in COLOUR_LIST of the colour of the unit cell at
+    column i and row j, or UNKNOWN_COLOUR for a colour not in COLOUR_LIST.
+
+    The array is allocated once and each leaf fills its square of cells with
+    a single slice assignment.
+
+    Precondition: numpy is installed.
+    """
+    dimension = 2 ** (block.max_depth - block.level)
+    grid = np.empty((dimension, dimension), dtype=np.uint8)
+
+    # Each entry is a block and the column and row of its upper-left cell.
+    pending = [(block, 0, 0)]
+    while pending:
+        current, x, y = pending.pop()
+        cells = 2 ** (current.max_depth - current.level)
+        children = current.children
+        if len(children) == 0:
+            grid[x:x + cells, y:y + cells] = _colour_index(current.colour)
+        else:
+            half = cells // 2
+            pending.append((children[0], x + half, y))
+            pending.append((children[1], x, y))
+            pending.append((children[2], x, y + half))
+            pending.append((children[3], x + half, y + half))
+
+    return grid
+
+
+def flatten_batch(boards: List[Block]) -> np.ndarray:
+    """Return the colour-index grids of <boards>, as returned by
+    _flatten_indices, stacked into one N x S x S uint8 array.
+
+    Preconditions:
+        - numpy is installed.
+        - all of <boards> have the same number of unit cells per side.
+    """
+    return np.stack([_flatten_indices(board) for board in boards])
+
+
+def _perimeter_cells(block: Block, colour: Tuple[int, int, int]) -> int:
+    """Return the number of unit cells of <colour> on the outer perimeter of
+    <block>, counting corner cells twice.
+
+    Only blocks that touch the perimeter are visited, and each leaf on the
+    perimeter adds its side length once for every edge that it touches.
+    """
+    dimension = 2 ** (block.max_depth - block.level)
+    total = 0
+
+    # Each entry is a block and the column and row of its upper-left cell.
+    pending = [(block, 0, 0)]
+    while pending:
+        current, x, y = pending.pop()
+        cells = 2 ** (current.max_depth - current.level)
+        if 0 < x and 0 < y and x + cells < dimension and y + cells < dimension:
+            # This block does not touch the perimeter.
+            continue
+
+        children = current.children
+        if len(children) == 0:
+            if current.colour == colour:
+                edges = (x == 0) + (y == 0) + (x + cells == dimension) + \
+                    (y + cells == dimension)
+                total += edges * cells
+        else:
+            half = cells // 2
+            pending.append((children[0], x + half, y))
+            pending.append((children[1], x, y))
+            pending.append((children[2], x, y + half))
+            pending.append((children[3], x + half, y + half))
+
+    return total
+
+
+def _colour_runs(grid: Union[np.ndarray, List[List[Any]]],
+                 only: Optional[Any] = None) -> \
+        Tuple[List[int], List[int], List[int], List[Any]]:
+    """Return the maximal runs of equal cells in each column of the square
+    <grid>, as four parallel lists: the column of each run, the row it starts
+    at, the row just after its end, and the value of its cells.
+
+    If <only> is not None, only the runs of cells equal to <only> are
+    returned. Runs are listed column by column, from top to bottom within a
+    column.
+    """
+    if np is not None:
+        grid = np.asarray(grid)
+        starts_mask = np.ones(grid.shape, dtype=bool)
+        ends_mask = np.ones(grid.shape, dtype=bool)
+        changes = grid[:, 1:] != grid[:, :-1]
+        starts_mask[:, 1:] = changes
+        ends_mask[:, :-1] = changes
+        columns, starts = np.nonzero(starts_mask)
+        ends = np.nonzero(ends_mask)[1] + 1
+        values = grid[columns, starts]
+        if only is not None:
+            keep = values == only
+            columns, starts, ends, values = \
+                columns[keep], starts[keep], ends[keep], values[keep]
+        return columns.tolist(), starts.tolist(), ends.tolist(), \
+            values.tolist()
+
+    columns, starts, ends, values = [], [], [], []
+    for i, column in enumerate(grid):
+        for j, cell in enumerate(column):
+            if j == 0 or cell != column[j - 1]:
+                if j != 0:
+                    ends.append(j)
+                columns.append(i)
+                starts.append(j)
+                values.append(cell)
+        ends.append(len(column))
+
+    if only is not None:
+        runs = [run for run in zip(columns, starts, ends, values)
+                if run[3] == only]
+        return [run[0] for run in runs], [run[1] for run in runs], \
+            [run[2] for run in runs], [run[3] for run in runs]
+    return columns, starts, ends, values
+
+
+class _DisjointSets:
+    """A union-find structure over the integers 0 to n - 1, where each element
+    has a size and each set knows the total size of its elements.
+
+    === Private Attributes ===
+    _parent:
+        The parent of each element. Roots are their own parent.
+    _sizes:
+        For each root, the total size of the elements in its set.
+    """
+    _parent: List[int]
+    _sizes: List[int]
+
+    def __init__(self, sizes: List[int]) -> None:
+        """Initialize one set for each element, with the given <sizes>.
+        """
+        self._parent = list(range(len(sizes)))
+        self._sizes = list(sizes)
+
+    def find(self, element: int) -> int:
+        """Return the root of the set containing <element>.
+        """
+        parent = self._parent
+        while parent[element] != element:
+            parent[element] = parent[parent[element]]
+            element = parent[element]
+        return element
+
+    def union(self, element_1: int, element_2: int) -> None:
+        """Merge the sets containing <element_1> and <element_2>.
+        """
+        root_1, root_2 = self.find(element_1), self.find(element_2)
+        if root_1 != root_2:
+            if self._sizes[root_1] < self._sizes[root_2]:
+                root_1, root_2 = root_2, root_1
+            self._parent[root_2] = root_1
+            self._sizes[root_1] += self._sizes[root_2]
+
+    def size(self, element: int) -> int:
+        """Return the total size of the set containing <element>.
+        """
+        return self._sizes[self.find(element)]
+
+    def roots(self) -> List[int]:
+        """Return the root of every set.
+        """
+        return [element for element in range(len(self._parent))
+                if self._parent[element] == element]
+
+    def largest(self) -> int:
+        """Return the total size of the largest set, or 0 if there are no
+        elements.
+        """
+        return max((self._sizes[root] for root in self.roots()), default=0)
+
+
+def _merge_runs(columns: List[int], starts: List[int], ends: List[int],
+                values: List[Any]) -> _DisjointSets:
+    """Return a union-find structure over the runs described by the four
+    parallel lists, as returned by _colour_runs, in which runs with the same
+    value that overlap in neighbouring columns are in the same set.
+
+    The size of each run is its length.
+    """
+    sets = _DisjointSets([end - start for start, end in zip(starts, ends)])
+
+    # Sweep the runs of each pair of neighbouring columns, like a merge.
+    first = 0
+    while first < len(columns):
+        column = columns[first]
+        second = first
+        while second < len(columns) and columns[second] == column:
+            second += 1
+        current = first
+        following = second
+        while current < second and following < len(columns) and \
+                columns[following] == column + 1:
+            if starts[current] < ends[following] and \
+                    starts[following] < ends[current] and \
+                    values[current] == values[following]:
+                sets.union(current, following)
+            if ends[current] < ends[following]:
+                current += 1
+            else:
+                following += 1
+        first = second
+
+    return sets
+
+
+def _largest_blob(mask: Union[np.ndarray, List[List[bool]]]) -> int:
+    """Return the number of cells in the largest group of connected True cells
+    in the square <mask>, where cells are connected if they share an edge.
+
+    The True cells of each column are grouped into runs, and runs that
+    overlap in neighbouring columns are merged with a union-find structure,
+    so no recursion is needed and the work is proportional to the number of
+    runs rather than the number of cells.
+    """
+    return _merge_runs(*_colour_runs(mask, True)).largest()
+
+
+def _leaves_in(block: Block, x: int, y: int, width: int, height: int) -> \
+        List[Tuple[Block, int, int]]:
+    """Return the leaves of <block> that overlap the rectangle of unit cells
+    with upper-left cell (<x>, <y>) and the given <width> and <height>, with
+    the column and row of each leaf's upper-left cell.
+
+    Only the blocks that overlap the rectangle are visited.
+    """
+    leaves = []
+    pending = [(block, 0, 0)]
+    while pending:
+        current, b_x, b_y = pending.pop()
+        cells = 2 ** (current.max_depth - current.level)
+        if b_x >= x + width or x >= b_x + cells or b_y >= y + height or \
+                y >= b_y + cells:
+            continue
+
+        children = current.children
+        if len(children) == 0:
+            leaves.append((current, b_x, b_y))
+        else:
+            half = cells // 2
+            pending.append((children[0], b_x + half, b_y))
+            pending.append((children[1], b_x, b_y))
+            pending.append((children[2], b_x, b_y + half))
+            pending.append((children[3], b_x + half, b_y + half))
+
+    return leaves
+
+
+def _leaf_blob_size(block: Block, colour: Tuple[int, int, int]) -> int:
+    """Return the number of unit cells in the largest blob of <colour> in
+    <block>, without flattening it.
+
+    The leaves of <colour> are the nodes of a graph in which two leaves are
+    joined if they share an edge. The neighbours of a leaf to its right and
+    below are found by searching the quadtree, and the areas of the leaves of
+    each connected component are added up with a union-find structure. The
+    work is proportional to the number of leaves, not unit cells.
+    """
+    dimension = 2 ** (block.max_depth - block.level)
+    targets = [(b_x, b_y, 2 ** (leaf.max_depth - leaf.level))
+               for leaf, b_x, b_y in _leaves_in(block, 0, 0, dimension,
+                                                dimension)
+               if leaf.colour == colour]
+    index = {(b_x, b_y): i for i, (b_x, b_y, _) in enumerate(targets)}
+    sets = _DisjointSets([cells * cells for _, _, cells in targets])
+
+    for i, (b_x, b_y, cells) in enumerate(targets):
+        neighbours = _leaves_in(block, b_x + cells, b_y, 1, cells) + \
+            _leaves_in(block, b_x, b_y + cells, cells, 1)
+        for leaf, n_x, n_y in neighbours:
+            if leaf.colour == colour:
+                sets.union(i, index[(n_x, n_y)])
+
+    return sets.largest()
+
+
+# The sides of a block, as indices into the edge profiles below.
+_TOP, _BOTTOM, _LEFT, _RIGHT = range(4)
+
+
+def _perimeter_edges(block: Block, colour: Tuple[int, int, int]) -> \
+        Tuple[int, int, int, int]:
+    """Return the number of unit cells of <colour> along the top, bottom, left
+    and right sides of <block>, in that order.
+
+    The result is cached on <block>, so after a move only the moved block and
+    its ancestors are recomputed.
+    """
+    return block.cached(('perimeter', colour),
+                        lambda b: _compute_perimeter_edges(b, colour))
+
+
+def _compute_perimeter_edges(block: Block, colour: Tuple[int, int, int]) -> \
+        Tuple[int, int, int, int]:
+    """Return _perimeter_edges(block, colour) from the sides of the children
+    of <block>.
+    """
+    children = block.children
+    if len(children) == 0:
+        cells = 2 ** (block.max_depth - block.level)
+        count = cells if block.colour == colour else 0
+        return count, count, count, count
+
+    upper_right, upper_left, lower_left, lower_right = \
+        [_perimeter_edges(child, colour) for child in children]
+    return (upper_left[_TOP] + upper_right[_TOP],
+            lower_left[_BOTTOM] + lower_right[_BOTTOM],
+            upper_left[_LEFT] + lower_left[_LEFT],
+            upper_right[_RIGHT] + lower_right[_RIGHT])
+
+
+class _BlobSummary:
+    """The blobs of one colour inside a block, as far as they matter to the
+    blocks around it.
+
+    Blobs that touch a side of the block may still grow into a neighbouring
+    block, so they are described by their sizes and by where they touch the
+    sides. Blobs that do not touch a side can no longer grow, so only the
+    largest of them is kept.
+
+    === Public Attributes ===
+    closed:
+        The size of the largest blob that does not touch a side of the block,
+        or 0 if there is none.
+    sizes:
+        The size of each blob that touches a side of the block. The blobs are
+        labelled by their index in <sizes>.
+    edges:
+        For each side of the block, in the order top, bottom, left and right,
+        the cells along that side as runs of (length, label): <label> is the
+        blob the cells belong to, or -1 if they are not of the colour. Runs go
+        from left to right, or from top to bottom.
+    """
+    closed: int
+    sizes: List[int]
+    edges: Tuple[List[Tuple[int, int]], ...]
+
+    def __init__(self, closed: int, sizes: List[int],
+                 edges: Tuple[List[Tuple[int, int]], ...]) -> None:
+        """Initialize this summary.
+        """
+        self.closed = closed
+        self.sizes = sizes
+        self.edges = edges
+
+    def largest(self) -> int:
+        """Return the size of the largest blob in the block.
+        """
+        return max([self.closed] + self.sizes)
+
+
+def _blob_summary(block: Block, colour: Tuple[int, int, int]) -> _BlobSummary:
+    """Return the summary of the blobs of <colour> in <block>.
+
+    The result is cached on <block>, so after a move only the summaries of
+    the moved block and its ancestors are recomputed, from the cached
+    summaries of their other children.
+    """
+    return block.cached(('blob', colour),
+                        lambda b: _compute_blob_summary(b, colour))
+
+
+def _join_runs(sets: _DisjointSets, side_1: List[Tuple[int, int]],
+               side_2: List[Tuple[int, int]]) -> None:
+    """Merge the blobs on either side of a seam, where <side_1> and <side_2>
+    are the runs of cells on the two sides of the seam.
+    """
+    i = j = 0
+    end_1, end_2 = side_1[0][0], side_2[0][0]
+    while True:
+        if side_1[i][1] >= 0 and side_2[j][1] >= 0:
+            sets.union(side_1[i][1], side_2[j][1])
+        if end_1 == end_2:
+            i += 1
+            j += 1
+            if i == len(side_1):
+                return
+            end_1 += side_1[i][0]
+            end_2 += side_2[j][0]
+        elif end_1 < end_2:
+            i += 1
+            end_1 += side_1[i][0]
+        else:
+            j += 1
+            end_2 += side_2[j][0]
+
+
+def _compute_blob_summary(block: Block, colour: Tuple[int, int, int]) -> \
+        _BlobSummary:
+    """Return _blob_summary(block, colour) from the summaries of the children
+    of <block>.
+    """
+    children = block.children
+    if len(children) == 0:
+        cells = 2 ** (block.max_depth - block.level)
+        if block.colour == colour:
+            return _BlobSummary(0, [cells * cells], ([(cells, 0)],) * 4)
+        return _BlobSummary(0, [], ([(cells, -1)],) * 4)
+
+    # Give the blobs of the four children distinct labels.
+    parts = [_blob_summary(child, colour) for child in children]
+    sizes = []
+    edges = []
+    for part in parts:
+        base = len(sizes)
+        sizes.extend(part.sizes)
+        edges.append([[(length, label + base if label >= 0 else -1)
+                       for length, label in side] for side in part.edges])
+    upper_right, upper_left, lower_left, lower_right = edges
+
+    sets = _DisjointSets(sizes)
+    _join_runs(sets, upper_left[_RIGHT], upper_right[_LEFT])
+    _join_runs(sets, lower_left[_RIGHT], lower_right[_LEFT])
+    _join_runs(sets, upper_left[_BOTTOM], lower_left[_TOP])
+    _join_runs(sets, upper_right[_BOTTOM], lower_right[_TOP])
+
+    sides = (upper_left[_TOP] + upper_right[_TOP],
+             lower_left[_BOTTOM] + lower_right[_BOTTOM],
+             upper_left[_LEFT] + lower_left[_LEFT],
+             upper_right[_RIGHT] + lower_right[_RIGHT])
+
+    # Relabel the blobs that still touch a side, and merge neighbouring runs
+    # of the same blob.
+    labels = {}
+    new_edges = []
+    for side in sides:
+        runs = []
+        for length, label in side:
+            if label >= 0:
+                root = sets.find(label)
+                if root not in labels:
+                    labels[root] = len(labels)
+                label = labels[root]
+            if runs and runs[-1][1] == label:
+                runs[-1] = (runs[-1][0] + length, label)
+            else:
+                runs.append((length, label))
+        new_edges.append(runs)
+
+    closed = max(part.closed for part in parts)
+    for root in sets.roots():
+        if root not in labels:
+            closed = max(closed, sets.size(root))
+    new_sizes = [sets.size(root) for root in labels]
+
+    return _BlobSummary(closed, new_sizes, tuple(new_edges))
+
+
+def _counterpart(board: Block, block: Block) -> Optional[Block]:
+    """Return the block of <board> at the same level and position as <block>,
+    copying it first if it is shared with another board, or None if <board>
+    has no such block.
+
+    Precondition: <board> is not shared with another board.
+    """
+    current = board
+    x, y = block.position
+    while current.level < block.level:
+        children = current.children
+        for i in range(len(children)):
+            c_x, c_y = children[i].position
+            if c_x <= x < c_x + children[i].size and \
+                    c_y <= y < c_y + children[i].size:
+                current = current.mutable_child(i)
+                break
+        else:
+            return None
+
+    return current
+
+
+def apply_move(block: Block, action: str, direction: Optional[int],
+               colour: Tuple[int, int, int],
+               journal: Optional[Journal] = None) -> bool:
+    """Perform the action named <action> on <block>, painting with <colour>,
+    and return True iff it was successful. The action is recorded in <journal>
+    if it is not None.
+
+    <action> and <direction> are the first two items of a move, as in
+    actions.py.
+    """
+    if action == 'rotate':
+        return block.rotate(direction, journal)
+    elif action == 'swap':
+        return block.swap(direction, journal)
+    elif action == 'smash':
+        return block.smash(journal)
+    elif action == 'paint':
+        return block.paint(colour, journal)
+    elif action == 'combine':
+        return block.combine(journal)
+    return action == 'pass'
+
+
+class ScoreCache:
+    """A bounded cache of goal scores that discards the least recently used
+    score when it is full.
+
+    === Public Attributes ===
+    capacity:
+        The maximum number of scores kept in this cache.
+    hits:
+        The number of lookups that found a score.
+    misses:
+        The number of lookups that did not find a score.
+
+    === Private Attributes ===
+    _scores:
+        The cached scores, from the least to the most recently used.
+
+    === Representation Invariants ===
+    - capacity >= 1
+    - len(_scores) <= capacity
+    """
+    capacity: int
+    hits: int
+    misses: int
+    _scores: OrderedDict
+
+    def __init__(self, capacity: int) -> None:
+        """Initialize an empty cache that holds at most <capacity> scores.
+
+        Precondition: capacity >= 1
+        """
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._scores = OrderedDict()
+
+    def __len__(self) -> int:
+        """Return the number of scores in this cache.
+        """
+        return len(self._scores)
+
+    def lookup(self, key: Hashable) -> Optional[int]:
+        """Return the score stored for <key>, or None if there is none.
+        """
+        score = self._scores.get(key)
+        if score is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._scores.move_to_end(key)
+        return score
+
+    def store(self, key: Hashable, score: int) -> None:
+        """Store <score> for <key>, discarding the least recently used scores
+        if this cache is over capacity.
+        """
+        self._scores[key] = score
+        self._scores.move_to_end(key)
+        while len(self._scores) > self.capacity:
+            self._scores.popitem(last=False)
+
+    def clear(self) -> None:
+        """Discard every score in this cache and reset its counters.
+        """
+        self._scores.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# The scores of every goal, keyed by the goal and the hash of the board.
+SCORE_CACHE = ScoreCache(4096)
+
+
 class Goal:
     """A player goal in the game of Blocky.
 
@@ -115,9 +710,60 @@ class Goal:
         """Return the current score for this goal on the given board.
 
         The score is always greater than or equal to 0.
+
+        Scores are looked up in SCORE_CACHE by this goal's colour and type and
+        the hash of <board>, and only computed on a miss.
+        """
+        key = (self.colour, type(self), board.board_hash())
+        score = SCORE_CACHE.lookup(key)
+        if score is None:
+            score = self._score(board)
+            SCORE_CACHE.store(key, score)
+        return score
+
+    def _score(self, board: Block) -> int:
+        """Return the current score for this goal on the given board, without
+        using SCORE_CACHE.
+        """
+        raise NotImplementedError
+
+    def score_batch(self, grids: np.ndarray) -> np.ndarray:
+        """Return the score for this goal on each of the boards flattened into
+        the N x S x S array <grids> by flatten_batch.
+
+        Precondition: numpy is installed.
         """
         raise NotImplementedError
 
+    def score_delta(self, board: Block,
+                    move: Tuple[str, Optional[int], Block]) -> int:
+        """Return how much the score for this goal on <board> would change if
+        <move> were made, without changing <board>.
+
+        <move> is a move on <board>, as returned by Player.generate_move;
+        a paint move paints with this goal's colour. A move that cannot be
+        made does not change the score. A smash is made with new random
+        children, so its delta is a sample.
+
+        The move is made on <board> itself, scored, and undone with a
+        Journal, so nothing is copied. The cached scores of every block off
+        the path to the moved block are reused, and the ones on it are
+        restored by the undo, so the cost depends on the moved block, not the
+        board.
+        """
+        action, direction, block = move
+        target = _counterpart(board, block)
+        if target is None or action == 'pass':
+            return 0
+
+        before = self.score(board)
+        journal = Journal()
+        if not apply_move(target, action, direction, self.colour, journal):
+            return 0
+        after = self.score(board)
+        journal.undo()
+        return after - before
+
     def description(self) -> str:
         """Return a description of this goal.
         """
@@ -136,28 +782,35 @@ class PerimeterGoal(Goal):
         this goal applies.
     """
 
-    def score(self, board: Block) -> int:
-        total = 0
-        new_board = _flatten(board)
-        size = range(len(new_board))
+    def _score(self, board: Block) -> int:
+        if isinstance(board, Block):
+            return sum(_perimeter_edges(board, self.colour))
+        return _perimeter_cells(board, self.colour)
 
-        for count in size:
-            if new_board[count][0] is self.colour:
-                total += 1
+    def score_grid(self, grid: np.ndarray) -> int:
+        """Return the score for this goal on the board flattened into <grid>
+        by _flatten_indices.
 
-        for count in size:
-            if new_board[count][len(new_board[0]) - 1] is self.colour:
-                total += 1
+        Corner cells are on two edges, so they are counted twice.
+        """
+        target = grid == _colour_index(self.colour)
+        return int(target[0].sum() + target[-1].sum() + target[:, 0].sum() +
+                   target[:, -1].sum())
 
-        for count in new_board[0]:
-            if count == self.colour:
-                total += 1
+    def score_bitboard(self, board: BitBoard) -> int:
+        """Return the score for this goal on the board encoded as <board>.
+        """
+        return board.perimeter(self.colour)
 
-        for count in new_board[len(new_board) - 1]:
-            if count == self.colour:
-                total += 1
+    def score_batch(self, grids: np.ndarray) -> np.ndarray:
+        """Return the score for this goal on each of the boards flattened into
+        the N x S x S array <grids> by flatten_batch.
 
-        return total
+        Precondition: numpy is installed.
+        """
+        target = grids == _colour_index(self.colour)
+        return target[:, 0, :].sum(axis=1) + target[:, -1, :].sum(axis=1) + \
+            target[:, :, 0].sum(axis=1) + target[:, :, -1].sum(axis=1)
 
     def description(self) -> str:
         statement = 'Achieve squares of' + colour_name(self.colour) + \
@@ -176,32 +829,33 @@ class BlobGoal(Goal):
             this goal applies.
     """
 
-    def score(self, board: Block) -> int:
-
-        temp_lst = []
-        new_board = _flatten(board)
-        num = range(len(new_board))
-        total = 0
-
-        for _ in num:
-            row = []
+    def _score(self, board: Block) -> int:
+        if isinstance(board, Block):
+            return _blob_summary(board, self.colour).largest()
+        return _leaf_blob_size(board, self.colour)
 
-            for _ in num:
-                row.append(-1)
-
-            temp_lst.append(row)
-
-        for pos_1 in num:
-            for pos_2 in num:
+    def score_grid(self, grid: np.ndarray) -> int:
+        """Return the score for this goal on the board flattened into <grid>
+        by _flatten_indices.
+        """
+        return _largest_blob(grid == _colour_index(self.colour))
 
-                target = (pos_1, pos_2)
-                new_target = self._undiscovered_blob_size(target,\
-                                                          new_board, temp_lst)
+    def score_bitboard(self, board: BitBoard) -> int:
+        """Return the score for this goal on the board encoded as <board>.
+        """
+        return board.largest_blob(self.colour)
 
-                if new_target > total:
-                    total = new_target
+    def score_batch(self, grids: np.ndarray) -> np.ndarray:
+        """Return the score for this goal on each of the boards flattened into
+        the N x S x S array <grids> by flatten_batch.
 
-        return total
+        Precondition: numpy is installed.
+        """
+        masks = grids == _colour_index(self.colour)
+        # Labelling every grid at once takes more numpy passes than the run
+        # merge of each grid on its own, so the grids are scored one by one.
+        return np.array([_largest_blob(mask) for mask in masks],
+                        dtype=np.int64)
 
     def _undiscovered_blob_size(self, pos: Tuple[int, int],
                                 board: List[List[Tuple[int, int, int]]],
@@ -224,32 +878,24 @@ class BlobGoal(Goal):
         either 0 or 1.
         """
         count = len(board)
+        total = 0
 
-        if pos[0] >= count or pos[1] >= count:
-            return 0
-
-        if visited[pos[0]][pos[1]] == 1 or visited[pos[0]][pos[1]] == 0:
-            return 0
-
-        if board[pos[0]][pos[1]] is not self.colour:
-            visited[pos[0]][pos[1]] = 0
-            return 0
-
-        visited[pos[0]][pos[1]] = 1
-
-        top = self._undiscovered_blob_size((pos[0], pos[1] - 1),\
-                                           board, visited)
-
-        bottom = self._undiscovered_blob_size((pos[0], pos[1] + 1),\
-                                              board, visited)
-
-        right = self._undiscovered_blob_size((pos[0] + 1, pos[1]),\
-                                             board, visited)
-
-        left = self._undiscovered_blob_size((pos[0] - 1, pos[1]),\
-                                            board, visited)
+        # The cells still to visit. They are visited with an explicit stack,
+        # so that large blobs do not exceed the recursion limit.
+        stack = [pos]
+        while stack:
+            x, y = stack.pop()
+            if not 0 <= x < count or not 0 <= y < count or \
+                    visited[x][y] != -1:
+                continue
+            if board[x][y] != self.colour:
+                visited[x][y] = 0
+                continue
+
+            visited[x][y] = 1
+            total += 1
+            stack.extend([(x, y - 1), (x, y + 1), (x + 1, y), (x - 1, y)])
 
-        total = 1 + top + bottom + right + left
         return total
 
     def description(self) -> str:
@@ -257,12 +903,57 @@ class BlobGoal(Goal):
         return statement
 
 
+def score_all(board: Block, goals: List[Goal]) -> List[int]:
+    """Return the score of each of <goals> on <board>, in order.
+
+    The board is flattened once, and the perimeter count and the largest blob
+    of every colour are found in a single pass over it. The scores are also
+    stored in SCORE_CACHE.
+    """
+    if np is not None:
+        grid = _flatten_indices(board)
+        left, right, top, bottom = \
+            grid[0].tolist(), grid[-1].tolist(), grid[:, 0].tolist(), \
+            grid[:, -1].tolist()
+    else:
+        grid = [[_colour_index(cell) for cell in column]
+                for column in _flatten(board)]
+        left, right = grid[0], grid[-1]
+        top, bottom = [column[0] for column in grid], \
+            [column[-1] for column in grid]
+
+    perimeters = {}
+    for cell in left + right + top + bottom:
+        perimeters[cell] = perimeters.get(cell, 0) + 1
+
+    columns, starts, ends, values = _colour_runs(grid)
+    sets = _merge_runs(columns, starts, ends, values)
+    blobs = {}
+    for root in sets.roots():
+        blobs[values[root]] = max(blobs.get(values[root], 0), sets.size(root))
+
+    scores = []
+    board_hash = board.board_hash()
+    for goal in goals:
+        index = _colour_index(goal.colour)
+        if isinstance(goal, PerimeterGoal):
+            score = perimeters.get(index, 0)
+        elif isinstance(goal, BlobGoal):
+            score = blobs.get(index, 0)
+        else:
+            score = goal.score(board)
+        SCORE_CACHE.store((goal.colour, type(goal), board_hash), score)
+        scores.append(score)
+
+    return scores
+
+
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'allowed-import-modules': [
             'doctest', 'python_ta', 'random', 'typing', 'block', 'settings',
-            'math', '__future__'
+            'math', '__future__', 'collections', 'numpy', 'bitboard'
         ],
         'max-attributes': 15
     })
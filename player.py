@@ -22,15 +22,25 @@ Misha Schwartz, and Jaisie Sin.
 This file contains the hierarchy of player classes.
 """
 from __future__ import annotations
-from typing import List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, wait
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, \
+    TYPE_CHECKING
+import math
+import pickle
 import random
-import pygame
+import time
 
-from block import Block
-from goal import Goal, generate_goals
+from block import Block, Journal
+from goal import Goal, apply_move, generate_goals
 
-from actions import KEY_ACTION, ROTATE_CLOCKWISE, ROTATE_COUNTER_CLOCKWISE, \
-    SWAP_HORIZONTAL, SWAP_VERTICAL, SMASH, PASS, PAINT, COMBINE
+from actions import ACTION_PENALTY, ROTATE_CLOCKWISE, \
+    ROTATE_COUNTER_CLOCKWISE, SWAP_HORIZONTAL, SWAP_VERTICAL, SMASH, PASS, \
+    PAINT, COMBINE
+
+if TYPE_CHECKING:
+    # pygame is only imported by the methods that handle the game window, so
+    # that players can be used without a display.
+    import pygame
 
 
 def create_players(num_human: int, num_random: int, smart_players: List[int]) \
@@ -77,94 +87,225 @@ def _get_block(block: Block, location: Tuple[int, int], level: int) -> \
 
     If no Block can be found at <location>, return None.
 
+    The child that includes <location> is picked from the coordinates, so
+    this descends once through at most max_depth blocks. A child that is
+    shared with another board is replaced by a private copy before it is
+    descended into, so the returned block can always be mutated.
+
     Preconditions:
         - 0 <= level <= max_depth
     """
-    pos_1 = block.position[0]
-    pos_2 = block.position[1]
+    if not _includes(block, location):
+        return None
 
-    bound_1 = pos_1 + block.size
-    bound_2 = pos_2 + block.size
+    while block.level < level and len(block.children) > 0:
+        block = block.mutable_child(_child_index(block, location))
+        if not _includes(block, location):
+            # <location> is in the gap left by rounding down the child size.
+            return None
 
-    if pos_1 <= location[0] < bound_1 and pos_2 <= location[1] < bound_2:
+    return block
 
-        if level == block.level or block.level == block.max_depth:
-            return block
 
-        else:
+def get_blocks(board: Block, locations: List[Tuple[int, int]], level: int) \
+        -> List[Optional[Block]]:
+    """Return the Block that _get_block(board, location, level) returns for
+    each location in <locations>, in the same order.
 
-            return _get_block_helper(block, location, level)
+    The locations are descended together, so each block on their paths is
+    visited once no matter how many of the locations it includes.
 
-    return None
+    Preconditions:
+        - 0 <= level <= max_depth
+    """
+    found = [None] * len(locations)
+    # Each entry is a block and the indices of the locations to find in it.
+    pending = [(board, list(range(len(locations))))]
+    while pending:
+        block, indices = pending.pop()
+        indices = [i for i in indices if _includes(block, locations[i])]
+        if block.level >= level or len(block.children) == 0:
+            for i in indices:
+                found[i] = block
+            continue
+
+        groups = {}
+        for i in indices:
+            groups.setdefault(_child_index(block, locations[i]), []).append(i)
+        for index, group in groups.items():
+            pending.append((block.mutable_child(index), group))
+
+    return found
+
+
+def _includes(block: Block, location: Tuple[int, int]) -> bool:
+    """Return True iff <block> includes <location>, as described in
+    _get_block.
+    """
+    x, y = block.position
+    return x <= location[0] < x + block.size and \
+        y <= location[1] < y + block.size
 
 
-def _get_block_helper(block: Block, location: Tuple[int, int], level: int) -> \
-        Optional[Block]:
+def _child_index(block: Block, location: Tuple[int, int]) -> int:
+    """Return the index of the child of <block> on the same side of its
+    middle as <location>.
+
+    Precondition: <block> has children.
     """
-    this is a helper method to avoid 'too many nested loop' PyTA error in the
-    _get_block method.
-    It recurse inside the children of that block if it has any
+    # The upper-left child is at the position of <block>.
+    size = block.children[1].size
+    right = location[0] >= block.position[0] + size
+    bottom = location[1] >= block.position[1] + size
+    if bottom:
+        return 3 if right else 2
+    return 0 if right else 1
+
+
+class Move(NamedTuple):
+    """A move on a Blocky board.
+
+    A Move is a tuple of the action being made, its direction, and the block
+    it is made on, as described in Player.generate_move, so it can be used
+    wherever such a tuple is expected.
     """
-    for i in block.children:
-        if _get_block(i, location, level) is not None:
-            return _get_block(i, location, level)
+    action: str
+    direction: Optional[int]
+    block: Block
+
 
-    return None
+# A move that does not refer to any Block: its action, its direction, and the
+# position and level of its block. It identifies the same move on any copy of
+# a board.
+_MoveKey = Tuple[str, Optional[int], Tuple[int, int], int]
 
 
-def _random_valid_moves(block: Block, goal: Goal) -> \
-        Tuple[Optional[Tuple[str, Optional[int], Block]], int]:
+def _move_key(move: Move) -> _MoveKey:
+    """Return the _MoveKey of <move>.
     """
-     This is a helper functions for the generate_move methods for both Random
-     Player and Smart Player that takes the player's goal a blocks then returns
-     a random valid move that can be preformed on the block
+    return move.action, move.direction, move.block.position, move.block.level
+
+
+def _find_move(board: Block, key: _MoveKey) -> Optional[Move]:
+    """Return the move on <board> whose _MoveKey is <key>, or None if <board>
+    has no block at the position and level in <key>.
     """
-    temp_board = block.create_copy()
-
-    random_level = random.randint(0, block.max_depth)
-    random_position_x = random.randint(0, block.position[0] + block.size)
-    random_position_y = random.randint(0, block.position[1] + block.size)
-
-    new_block = _get_block(temp_board, (random_position_x, random_position_y),\
-                           random_level)
-    if new_block:
-        new_block = new_block.create_copy()
-    else:
-        return _random_valid_moves(block, goal)
-
-    random_move = random.randint(1, 7)
-
-    if random_move == 1:
-        if new_block.rotate(1):
-            score = goal.score(temp_board)
-            return _create_move(ROTATE_CLOCKWISE, new_block), score
-    if random_move == 2:
-        if new_block.rotate(3):
-            score = goal.score(temp_board)
-            return _create_move(ROTATE_COUNTER_CLOCKWISE, new_block), score
-    if random_move == 3:
-        if new_block.swap(0):
-            score = goal.score(temp_board)
-            return _create_move(SWAP_HORIZONTAL, new_block), score
-    if random_move == 4:
-        if new_block.swap(1):
-            score = goal.score(temp_board)
-            return _create_move(SWAP_VERTICAL, new_block), score
-    if random_move == 5:
-        if new_block.smash():
-            score = goal.score(temp_board)
-            return _create_move(SMASH, new_block), score
-    if random_move == 6:
-        if new_block.combine():
-            score = goal.score(temp_board)
-            return _create_move(COMBINE, new_block), score
-    if random_move == 7:
-        random_color = goal.colour
-        if new_block.paint(random_color):
-            score = goal.score(temp_board)
-            return _create_move(PAINT, new_block), score
-
-    return _random_valid_moves(block, goal)
+    action, direction, position, level = key
+    block = _get_block(board, position, level)
+    if block is None or block.level != level:
+        return None
+    return Move(action, direction, block)
+
+
+# The actions that can be performed on every block with children.
+_REORIENT_ACTIONS = [ROTATE_CLOCKWISE, ROTATE_COUNTER_CLOCKWISE,
+                     SWAP_HORIZONTAL, SWAP_VERTICAL]
+
+
+def legal_moves(board: Block, colour: Tuple[int, int, int]) -> Iterator[Move]:
+    """Yield every valid move on <board>, where a paint move paints with
+    <colour>.
+
+    A valid move is a move other than PASS that can be successfully
+    performed on <board>. The moves are found in one traversal of <board>,
+    without performing any of them, so <board> must not be changed until
+    they have all been yielded.
+
+    The traversal goes through Block.mutable_child, like _get_block, so the
+    block of every move is a private block of <board>: making the move does
+    not change any board that <board> shares blocks with.
+
+    Precondition: <board> is not shared with another board.
+    """
+    pending = [board]
+    while pending:
+        block = pending.pop()
+        yield from _block_moves(block, colour)
+        pending.extend(block.mutable_child(i)
+                       for i in range(len(block.children)))
+
+
+def _block_moves(block: Block, colour: Tuple[int, int, int]) -> List[Move]:
+    """Return every valid move on <block> itself, where a paint move paints
+    with <colour>.
+    """
+    children = block.children
+    if len(children) > 0:
+        moves = [_create_move(action, block) for action in _REORIENT_ACTIONS]
+        if block.level == block.max_depth - 1 and \
+                _has_majority_colour(children):
+            moves.append(_create_move(COMBINE, block))
+        return moves
+
+    moves = []
+    if block.smashable():
+        moves.append(_create_move(SMASH, block))
+    if block.colour != colour:
+        moves.append(_create_move(PAINT, block))
+    return moves
+
+
+def _has_majority_colour(blocks: List[Block]) -> bool:
+    """Return True iff more of <blocks> have one colour than any other, as
+    required by Block.combine.
+    """
+    counts = {}
+    for block in blocks:
+        counts[block.colour] = counts.get(block.colour, 0) + 1
+    most = max(counts.values())
+    return list(counts.values()).count(most) == 1
+
+
+def random_legal_moves(board: Block, colour: Tuple[int, int, int],
+                       num_moves: int) -> List[Move]:
+    """Return <num_moves> valid moves on <board>, each chosen uniformly at
+    random, with replacement, from legal_moves(board, colour).
+
+    Return an empty list if there is no valid move on <board>.
+    """
+    moves = list(legal_moves(board, colour))
+    if len(moves) == 0:
+        return []
+    return random.choices(moves, k=num_moves)
+
+
+# The number of candidate moves that SmartPlayer evaluates in each task it
+# submits to its executor. It does not depend on the number of workers, so
+# the moves chosen do not either.
+_CANDIDATES_PER_TASK = 16
+
+# The board most recently unpickled by _best_candidate in this process, by
+# its board_hash. Assessing moves leaves a board unchanged, so the next task
+# on the same board reuses it, along with its cached scores.
+_WORKER_BOARD = {}
+
+
+def _best_candidate(pickled_board: bytes, board_hash: int, goal: Goal,
+                    num_moves: int, seed: int) -> \
+        Tuple[int, Optional[_MoveKey]]:
+    """Return the largest change of score for <goal> among <num_moves> random
+    valid moves on the pickled board <pickled_board>, whose board_hash is
+    <board_hash>, and the _MoveKey of that move.
+
+    The move is None if no move increases the score. The moves, including
+    any smash, are generated after seeding random with <seed>, so the result
+    only depends on the arguments. This is run in the worker processes of
+    SmartPlayer's executor; each process runs one task at a time, so seeding
+    random and reusing _WORKER_BOARD is safe there, but not in threads.
+    """
+    random.seed(seed)
+    if board_hash not in _WORKER_BOARD:
+        _WORKER_BOARD.clear()
+        _WORKER_BOARD[board_hash] = pickle.loads(pickled_board)
+    board = _WORKER_BOARD[board_hash]
+    best = None
+    best_delta = 0
+    for move in random_legal_moves(board, goal.colour, num_moves):
+        delta = goal.score_delta(board, move)
+        if delta > best_delta:
+            best_delta = delta
+            best = _move_key(move)
+    return best_delta, best
 
 
 class Player:
@@ -212,10 +353,35 @@ class Player:
         """
         raise NotImplementedError
 
+    def proceed(self) -> None:
+        """Let this player make its next move, as clicking in the game window
+        does for a computer player.
+        """
+        raise NotImplementedError
 
-def _create_move(action: Tuple[str, Optional[int]], block: Block) -> \
-        Tuple[str, Optional[int], Block]:
-    return action[0], action[1], block
+    def ready_to_move(self) -> bool:
+        """Return True iff generate_move would make a move now, rather than
+        return None because the player is still waiting to proceed.
+        """
+        raise NotImplementedError
+
+    def generates_in_background(self) -> bool:
+        """Return True iff generate_move may be called from another thread,
+        on a copy of the game board, while the game keeps running.
+        """
+        return True
+
+
+def move_on(board: Block, move: Tuple[str, Optional[int], Block]) -> \
+        Optional[Move]:
+    """Return the same move as <move>, which is a move on a copy of <board>,
+    but on <board>, or None if <board> has no such block.
+    """
+    return _find_move(board, _move_key(Move(*move)))
+
+
+def _create_move(action: Tuple[str, Optional[int]], block: Block) -> Move:
+    return Move(action[0], action[1], block)
 
 
 class HumanPlayer(Player):
@@ -249,6 +415,8 @@ class HumanPlayer(Player):
 
         If no block is selected by the player, return None.
         """
+        import pygame
+
         mouse_pos = pygame.mouse.get_pos()
         block = _get_block(board, mouse_pos, self._level)
 
@@ -259,6 +427,9 @@ class HumanPlayer(Player):
         the mapping in KEY_ACTION, as well as the W and S keys for changing
         the level.
         """
+        import pygame
+        from actions import KEY_ACTION
+
         if event.type == pygame.KEYDOWN:
             if event.key in KEY_ACTION:
                 self._desired_action = KEY_ACTION[event.key]
@@ -286,6 +457,20 @@ class HumanPlayer(Player):
             self._desired_action = None
             return move
 
+    def proceed(self) -> None:
+        """Do nothing, since this player moves when the user presses a key.
+        """
+        return
+
+    def ready_to_move(self) -> bool:
+        return self._desired_action is not None
+
+    def generates_in_background(self) -> bool:
+        """Return False, since this player's moves come from the mouse and
+        keyboard of the game window.
+        """
+        return False
+
 
 class RandomPlayer(Player):
     """
@@ -306,8 +491,16 @@ class RandomPlayer(Player):
         return None
 
     def process_event(self, event: pygame.event.Event) -> None:
+        import pygame
+
         if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-            self._proceed = True
+            self.proceed()
+
+    def proceed(self) -> None:
+        self._proceed = True
+
+    def ready_to_move(self) -> bool:
+        return self._proceed
 
     def generate_move(self, board: Block) ->\
             Optional[Tuple[str, Optional[int], Block]]:
@@ -321,9 +514,11 @@ class RandomPlayer(Player):
         if not self._proceed:
             return None
 
-        move = _random_valid_moves(board, self.goal)
+        moves = random_legal_moves(board, self.goal.colour, 1)
         self._proceed = False
-        return move[0]
+        if len(moves) == 0:
+            return _create_move(PASS, board)
+        return moves[0]
 
 
 class SmartPlayer(Player):
@@ -335,21 +530,63 @@ class SmartPlayer(Player):
      _proceed:
        True when the player should make a move, False when the player should
        wait.
+     _difficulty:
+       The number of random moves this player assesses for each move.
+     _executor:
+       The process pool that the moves are assessed in, in parallel, or None
+       if they are assessed in this process.
+     _random:
+       The source of the seeds of the tasks submitted to <_executor>.
+     _time_budget:
+       The largest number of seconds that assessing moves may take, or None.
     """
     _proceed: bool
     _difficulty: int
-
-    def __init__(self, player_id: int, goal: Goal, difficulty: int) -> None:
+    _executor: Optional[ProcessPoolExecutor]
+    _random: random.Random
+    _time_budget: Optional[float]
+
+    def __init__(self, player_id: int, goal: Goal, difficulty: int,
+                 executor: Optional[ProcessPoolExecutor] = None,
+                 seed: Optional[int] = None,
+                 time_budget: Optional[float] = None) -> None:
+        """Initialize this SmartPlayer.
+
+        If <executor> is not None, the moves are assessed in its worker
+        processes. The moves then only depend on the board and <seed>, not on
+        the number of workers, unless <time_budget> runs out. Any other kind
+        of executor raises a TypeError, since assessing a move mutates the
+        board and seeds random in the worker.
+
+        If <time_budget> is not None, this player stops assessing moves after
+        <time_budget> seconds, and makes the best move assessed so far.
+        <difficulty> is still the most moves it assesses.
+        """
+        if executor is not None and \
+                not isinstance(executor, ProcessPoolExecutor):
+            raise TypeError('SmartPlayer can only assess its moves in a '
+                            'ProcessPoolExecutor')
         Player.__init__(self, player_id, goal)
         self._proceed = False
         self._difficulty = difficulty
+        self._executor = executor
+        self._random = random.Random(seed)
+        self._time_budget = time_budget
 
     def get_selected_block(self, board: Block) -> Optional[Block]:
         return None
 
     def process_event(self, event: pygame.event.Event) -> None:
+        import pygame
+
         if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-            self._proceed = True
+            self.proceed()
+
+    def proceed(self) -> None:
+        self._proceed = True
+
+    def ready_to_move(self) -> bool:
+        return self._proceed
 
     def generate_move(self, board: Block) ->\
             Optional[Tuple[str, Optional[int], Block]]:
@@ -363,26 +600,534 @@ class SmartPlayer(Player):
 
         This function does not mutate <board>.
         """
-        moves = []
         if not self._proceed:
             return None  # Do not remove
 
-        for _ in range(self._difficulty):
-            moves.append(_random_valid_moves(board, self.goal))
+        deadline = None
+        if self._time_budget is not None:
+            deadline = time.monotonic() + self._time_budget
+
+        if self._executor is not None:
+            best_move = self._generate_move_in_executor(board, deadline)
+        else:
+            best_move = _create_move(PASS, board)
+            best_delta = 0
+            moves = list(legal_moves(board, self.goal.colour))
+            for _ in range(self._difficulty if len(moves) > 0 else 0):
+                # checking the change of score of a random valid move
+                move = random.choice(moves)
+                delta = self.goal.score_delta(board, move)
+                if delta > best_delta:
+                    best_delta = delta
+                    best_move = move
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+
+        self._proceed = False
+        return best_move
+
+    def _generate_move_in_executor(self, board: Block,
+                                   deadline: Optional[float]) -> Move:
+        """Return the best of <_difficulty> random valid moves on <board>, or
+        PASS if none of them increases the score, assessing the moves in
+        tasks of _CANDIDATES_PER_TASK moves in <_executor>.
+
+        If <deadline> is not None, the tasks are submitted in rounds of 1, 2,
+        4, ... tasks, and only the moves assessed by time.monotonic() ==
+        <deadline> are considered.
+        """
+        pickled_board = pickle.dumps(board)
+        board_hash = board.board_hash()
+        num_tasks = -(-self._difficulty // _CANDIDATES_PER_TASK)
+        round_size = 1 if deadline is not None else num_tasks
+
+        best = None
+        best_delta = 0
+        submitted = 0
+        while submitted < num_tasks:
+            futures = []
+            for _ in range(min(round_size, num_tasks - submitted)):
+                start = submitted * _CANDIDATES_PER_TASK
+                num_moves = min(_CANDIDATES_PER_TASK, self._difficulty - start)
+                seed = self._random.getrandbits(64)
+                futures.append(self._executor.submit(
+                    _best_candidate, pickled_board, board_hash, self.goal,
+                    num_moves, seed))
+                submitted += 1
+
+            timeout = None
+            if deadline is not None:
+                timeout = max(0.0, deadline - time.monotonic())
+            done = wait(futures, timeout).done
+            # The first task wins a tie, so the result does not depend on the
+            # order that the tasks finish in.
+            for future in futures:
+                if future in done:
+                    delta, candidate = future.result()
+                    if delta > best_delta:
+                        best_delta = delta
+                        best = candidate
+                else:
+                    future.cancel()
+
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            round_size *= 2
+
+        if best is None:
+            return _create_move(PASS, board)
+        return _find_move(board, best)
+
+
+class _SearchNode:
+    """A node in the search tree of an MCTSPlayer.
+
+    A node stands for the sequence of moves on the path to it from the root,
+    made on the board that the root was searched from. Its statistics are
+    over the boards reached by making those moves, which vary when one of
+    them is a smash.
+
+    === Public Attributes ===
+    visits:
+        The number of rollouts made through this node.
+    total:
+        The sum of the rewards of those rollouts.
+    children:
+        The node for each move from this node that has been tried, by the
+        _MoveKey of the move.
+    untried:
+        The moves from this node that have not been tried yet, or None if
+        the moves from this node have not been generated yet.
+    """
+    visits: int
+    total: float
+    children: Dict[_MoveKey, _SearchNode]
+    untried: Optional[List[_MoveKey]]
+
+    def __init__(self) -> None:
+        """Initialize this node with no rollouts made through it.
+        """
+        self.visits = 0
+        self.total = 0.0
+        self.children = {}
+        self.untried = None
+
+
+class MCTSPlayer(Player):
+    """
+    A player who chooses moves by Monte Carlo tree search, using UCT over the
+    valid moves and PASS.
+
+    Each iteration replays a path of moves from the root of the search tree
+    on the board itself, adds one new move to the tree, makes random moves
+    until the end of the game, and rewards the path with the score for this
+    player's goal minus the penalties of the moves made. Every move is
+    recorded in a Journal and undone afterwards. The moves of the other
+    players are not predicted.
 
-        max_score_move = self.goal.score(board)
-        best_move = ()
-        for move in moves:
-            # checking the score of each move
-            score = move[1]
-            if score > max_score_move:
-                max_score_move = score
-                best_move = (move[0])
+    After choosing a move, the subtree under it is kept, and reused as the
+    root of the next search if the board is the one the move led to (for
+    example, if the other players passed).
+
+     === Private Attributes ===
+     _proceed:
+       True when the player should make a move, False when the player should
+       wait.
+     _turns_left:
+       The number of moves this player has left to make in the game.
+     _iterations:
+       The largest number of iterations of each search, or None.
+     _time_budget:
+       The largest number of seconds each search may take, or None.
+     _random:
+       The source of the random moves made in rollouts.
+     _tree:
+       The board_hash of the board that the next search is expected to start
+       from, and the search tree kept for it, or None.
+     _low:
+       The lowest reward seen by the current search.
+     _high:
+       The highest reward seen by the current search.
+
+    === Representation Invariants ===
+    - _iterations is not None or _time_budget is not None
+    """
+    _proceed: bool
+    _turns_left: int
+    _iterations: Optional[int]
+    _time_budget: Optional[float]
+    _random: random.Random
+    _tree: Optional[Tuple[int, _SearchNode]]
+    _low: float
+    _high: float
+
+    def __init__(self, player_id: int, goal: Goal, max_turns: int,
+                 iterations: Optional[int] = None,
+                 time_budget: Optional[float] = None,
+                 seed: Optional[int] = None) -> None:
+        """Initialize this MCTSPlayer for a game of <max_turns> turns.
+
+        Each search stops after <iterations> iterations or <time_budget>
+        seconds, whichever comes first. If neither is given, it stops after
+        1000 iterations.
+        """
+        Player.__init__(self, player_id, goal)
+        self._proceed = False
+        self._turns_left = max_turns
+        if iterations is None and time_budget is None:
+            iterations = 1000
+        self._iterations = iterations
+        self._time_budget = time_budget
+        self._random = random.Random(seed)
+        self._tree = None
+        self._low = 0.0
+        self._high = 0.0
+
+    def get_selected_block(self, board: Block) -> Optional[Block]:
+        return None
+
+    def process_event(self, event: pygame.event.Event) -> None:
+        import pygame
+
+        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            self.proceed()
+
+    def proceed(self) -> None:
+        self._proceed = True
+
+    def ready_to_move(self) -> bool:
+        return self._proceed
+
+    def generate_move(self, board: Block) ->\
+            Optional[Tuple[str, Optional[int], Block]]:
+        """Return the move made most often from the root of a Monte Carlo tree
+        search of the rest of the game from <board>.
+
+        This function does not mutate <board>.
+        """
+        if not self._proceed:
+            return None  # Do not remove
+
+        root = _SearchNode()
+        if self._tree is not None and self._tree[0] == board.board_hash():
+            root = self._tree[1]
+        turns = max(1, self._turns_left)
+
+        self._low = math.inf
+        self._high = -math.inf
+        start = time.monotonic()
+        iterations = 0
+        limit = self._iterations
+        # At least one iteration is run, so that the root has a child to
+        # choose even if the budget is already spent.
+        while iterations == 0 or \
+                (limit is None or iterations < limit) and \
+                (self._time_budget is None or
+                 time.monotonic() - start < self._time_budget):
+            self._iterate(board, root, turns)
+            iterations += 1
+
+        key = max(root.children, key=lambda k: root.children[k].visits)
+        move = _find_move(board, key)
+        self._keep_subtree(board, move, root.children[key])
+
+        self._turns_left = max(0, self._turns_left - 1)
+        self._proceed = False
+        return move
+
+    def _iterate(self, board: Block, root: _SearchNode, turns: int) -> None:
+        """Run one iteration of the search from <root> on <board>, with
+        <turns> moves left in the game, and leave <board> unchanged.
+        """
+        journal = Journal()
+        path = [root]
+        penalty = 0
+
+        # Selection and expansion
+        node = root
+        while len(path) <= turns:
+            if node.untried is None:
+                node.untried = self._moves(board)
+            if len(node.untried) > 0:
+                key = node.untried.pop()
+                node.children[key] = _SearchNode()
+            elif len(node.children) > 0:
+                key = max(node.children,
+                          key=lambda k, n=node: self._uct(n, n.children[k]))
+            else:
+                break
+            if not self._make(board, key, journal):
+                # A smash earlier on the path made this move invalid.
+                break
+            penalty += ACTION_PENALTY[key[:2]]
+            node = node.children[key]
+            path.append(node)
+            if node.visits == 0:
+                break
+
+        # Rollout
+        for _ in range(turns + 1 - len(path)):
+            move = self._rollout_move(board)
+            if move is not None:
+                apply_move(move.block, move.action, move.direction,
+                           self.goal.colour, journal)
+                penalty += ACTION_PENALTY[(move.action, move.direction)]
+
+        reward = self.goal.score(board) - penalty
+        journal.rollback(0)
+
+        self._low = min(self._low, reward)
+        self._high = max(self._high, reward)
+        for node in path:
+            node.visits += 1
+            node.total += reward
+
+    def _moves(self, board: Block) -> List[_MoveKey]:
+        """Return the _MoveKey of every valid move on <board>, and of PASS, in
+        a random order.
+        """
+        keys = [_move_key(move)
+                for move in legal_moves(board, self.goal.colour)]
+        keys.append(_move_key(_create_move(PASS, board)))
+        self._random.shuffle(keys)
+        return keys
+
+    def _rollout_move(self, board: Block) -> Optional[Move]:
+        """Return a random valid move on <board>, or None to pass.
+
+        The block is found by descending from <board> through random children
+        to a random level, and the move is chosen from its valid moves and
+        PASS. This is not uniform over all the valid moves, but takes time
+        proportional to max_depth instead of the size of <board>.
+        """
+        block = board
+        level = self._random.randint(0, board.max_depth)
+        while block.level < level and len(block.children) > 0:
+            block = block.mutable_child(self._random.randrange(4))
+
+        moves = _block_moves(block, self.goal.colour)
+        index = self._random.randrange(len(moves) + 1)
+        return moves[index] if index < len(moves) else None
+
+    def _make(self, board: Block, key: _MoveKey, journal: Journal) -> bool:
+        """Make the move with _MoveKey <key> on <board>, recording it in
+        <journal>, and return True iff it was successful.
+        """
+        move = _find_move(board, key)
+        return move is not None and \
+            apply_move(move.block, move.action, move.direction,
+                       self.goal.colour, journal)
+
+    def _uct(self, parent: _SearchNode, child: _SearchNode) -> float:
+        """Return the upper confidence bound of the move from <parent> to
+        <child>, with rewards scaled to the range seen by this search.
+        """
+        if child.visits == 0:
+            return math.inf
+        spread = max(1.0, self._high - self._low)
+        mean = (child.total / child.visits - self._low) / spread
+        return mean + math.sqrt(2 * math.log(parent.visits) / child.visits)
+
+    def _keep_subtree(self, board: Block, move: Move,
+                      subtree: _SearchNode) -> None:
+        """Keep <subtree>, the search tree under <move>, for the next search
+        if the board it leads to is known.
+        """
+        self._tree = None
+        if move.action == 'pass':
+            self._tree = (board.board_hash(), subtree)
+        elif move.action != 'smash':
+            journal = Journal()
+            apply_move(move.block, move.action, move.direction,
+                       self.goal.colour, journal)
+            self._tree = (board.board_hash(), subtree)
+            journal.undo()
+
+
+class LookaheadPlayer(Player):
+    """
+    A player who searches the next few moves of the game, its own and the
+    other players', and chooses the move that leads to the highest expected
+    score for its goal, minus its penalties.
+
+    The search alternates between this player and the other players, in
+    turn order. On each move, only the <beam_width> moves that most improve
+    the score for the goal of the player moving, minus penalty, are searched.
+    This player is assumed to choose the best of its moves, and each other
+    player to choose one of its moves at random. The value of each board
+    searched is kept in a transposition table by its board_hash, so a board
+    reached by different moves is only searched once.
+
+    With a time budget, the moves of this player are searched in the order
+    of the beam, and the best one whose search finished in time is chosen.
+
+    === Public Attributes ===
+    nodes_per_second:
+        The number of boards searched per second by the last search.
+
+     === Private Attributes ===
+     _proceed:
+       True when the player should make a move, False when the player should
+       wait.
+     _goals:
+       The goal of each player, in turn order, starting with this player.
+     _plies:
+       The number of moves searched, counting those of every player.
+     _beam_width:
+       The number of moves searched from each board.
+     _table:
+       The value of each board searched by the current search, by its
+       board_hash and the number of moves made to reach it.
+     _nodes:
+       The number of boards searched by the current search.
+     _time_budget:
+       The largest number of seconds each search may take, or None.
+     _deadline:
+       The time.monotonic() at which the current search must stop, or None.
+
+    === Representation Invariants ===
+    - _plies >= 1
+    - _beam_width >= 1
+    """
+    nodes_per_second: float
+    _proceed: bool
+    _goals: List[Goal]
+    _plies: int
+    _beam_width: int
+    _table: Dict[Tuple[int, int], float]
+    _nodes: int
+    _time_budget: Optional[float]
+    _deadline: Optional[float]
+
+    def __init__(self, player_id: int, goal: Goal, opponents: List[Goal],
+                 plies: int = 2, beam_width: int = 3,
+                 time_budget: Optional[float] = None) -> None:
+        """Initialize this LookaheadPlayer.
+
+        <opponents> are the goals of the other players, in the order that
+        they move after this player.
+
+        If <time_budget> is not None, each search stops after <time_budget>
+        seconds, and the best move searched fully by then is made.
+        """
+        Player.__init__(self, player_id, goal)
+        self.nodes_per_second = 0.0
+        self._proceed = False
+        self._goals = [goal] + opponents
+        self._plies = plies
+        self._beam_width = beam_width
+        self._table = {}
+        self._nodes = 0
+        self._time_budget = time_budget
+        self._deadline = None
+
+    def get_selected_block(self, board: Block) -> Optional[Block]:
+        return None
+
+    def process_event(self, event: pygame.event.Event) -> None:
+        import pygame
+
+        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            self.proceed()
+
+    def proceed(self) -> None:
+        self._proceed = True
+
+    def ready_to_move(self) -> bool:
+        return self._proceed
+
+    def generate_move(self, board: Block) ->\
+            Optional[Tuple[str, Optional[int], Block]]:
+        """Return the move with the highest expected value found by searching
+        the next <_plies> moves from <board>.
+
+        This function does not mutate <board>.
+        """
+        if not self._proceed:
+            return None  # Do not remove
+
+        self._table = {}
+        self._nodes = 1
+        start = time.monotonic()
+        self._deadline = None
+        if self._time_budget is not None:
+            self._deadline = start + self._time_budget
+
+        # The beam is sorted by gain, so its first move is the best one if
+        # there is no time to search any of them.
+        keys = self._beam(board, self.goal)
+        best_key = keys[0]
+        best_value = -math.inf
+        for key in keys:
+            value = self._value_after(board, key, 0)
+            if self._out_of_time():
+                # The search of this move may have been cut short, so its
+                # value cannot be compared with the others.
+                break
+            if value > best_value:
+                best_key = key
+                best_value = value
+
+        elapsed = time.monotonic() - start
+        self.nodes_per_second = self._nodes / max(elapsed, 1e-9)
+        self._proceed = False
+        return _find_move(board, best_key)
+
+    def _beam(self, board: Block, goal: Goal) -> List[_MoveKey]:
+        """Return the _MoveKeys of the <_beam_width> valid moves on <board>,
+        or PASS, that most increase the score for <goal> minus penalty.
+        """
+        moves = list(legal_moves(board, goal.colour))
+        moves.append(_create_move(PASS, board))
+        gains = [goal.score_delta(board, move) -
+                 ACTION_PENALTY[(move.action, move.direction)]
+                 for move in moves]
+        order = sorted(range(len(moves)), key=lambda i: -gains[i])
+        return [_move_key(moves[i]) for i in order[:self._beam_width]]
+
+    def _value(self, board: Block, ply: int) -> float:
+        """Return the expected score for this player's goal, minus the
+        penalties of its moves from now on, after the last <_plies> - <ply>
+        moves of the search are made on <board>.
+
+        <ply> moves of the search have been made already.
+        """
+        if ply == self._plies or self._out_of_time():
+            return self.goal.score(board)
+
+        entry = (board.board_hash(), ply)
+        if entry not in self._table:
+            self._nodes += 1
+            goal = self._goals[ply % len(self._goals)]
+            values = [self._value_after(board, key, ply)
+                      for key in self._beam(board, goal)]
+            if goal is self.goal:
+                self._table[entry] = max(values)
+            else:
+                self._table[entry] = sum(values) / len(values)
+        return self._table[entry]
+
+    def _out_of_time(self) -> bool:
+        """Return True iff the current search has run past its deadline.
+        """
+        return self._deadline is not None and \
+            time.monotonic() >= self._deadline
+
+    def _value_after(self, board: Block, key: _MoveKey, ply: int) -> float:
+        """Return the value of the move with _MoveKey <key> on <board>, which
+        is made as move <ply> of the search, and leave <board> unchanged.
+        """
+        goal = self._goals[ply % len(self._goals)]
+        journal = Journal()
+        move = _find_move(board, key)
+        apply_move(move.block, move.action, move.direction, goal.colour,
+                   journal)
+        value = self._value(board, ply + 1)
+        journal.rollback(0)
 
-        current_score = self.goal.score(board)
-        if max_score_move > current_score:
-            return best_move
-        return _create_move(PASS, board)
+        if goal is self.goal:
+            value -= ACTION_PENALTY[key[:2]]
+        return value
 
 
 if __name__ == '__main__':
@@ -392,8 +1137,9 @@ if __name__ == '__main__':
         'allowed-io': ['process_event'],
         'allowed-import-modules': [
             'doctest', 'python_ta', 'random', 'typing', 'actions', 'block',
-            'goal', 'pygame', '__future__'
+            'goal', 'pygame', '__future__', 'concurrent.futures', 'pickle',
+            'math', 'time'
         ],
-        'max-attributes': 10,
+        'max-attributes': 11,
         'generated-members': 'pygame.*'
     })